@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+"""Simple benchmarks for formbar. The benchmarks run against a generated
+form configuration with a configurable number of fields."""
+import timeit
+import time
+import argparse
+import multiprocessing
+import resource
+import sys
+import sqlalchemy as sa
+import sqlalchemy.orm
+from sqlalchemy.ext.declarative import declarative_base
+from formbar.config import Config, parse
+from formbar.form import Form, FormPrototype
+from formbar.parallel import ValidationPool
+from formbar.renderer import FormRenderer
+from formbar import converters
+
+TYPES = ["string", "integer", "float", "date"]
+VALUES = {"string": u"foo", "integer": u"16",
+          "float": u"87.5", "date": u"1998-02-01"}
+DATE_VALUES = {"en": {"date": u"1998-02-01",
+                      "datetime": u"1998-02-01 12:30:00"},
+               "de": {"date": u"01.02.1998",
+                      "datetime": u"01.02.1998 12:30:00"}}
+
+
+def generate_config(num_fields):
+    """Will return a form configuration with a single form with the id
+    'benchmark' containing `num_fields` fields. The fields are of
+    different datatypes and every integer field has a rule."""
+    xml = []
+    xml.append('<configuration>')
+    xml.append('<source>')
+    for num in range(num_fields):
+        ftype = TYPES[num % len(TYPES)]
+        xml.append('<entity id="e%s" name="f%s" type="%s">' % (num, num, ftype))
+        if ftype == "integer":
+            xml.append('<rule expr="$f%s ge 16" msg="Too small"/>' % num)
+        xml.append('</entity>')
+    xml.append('</source>')
+    xml.append('<form id="benchmark">')
+    for num in range(num_fields):
+        xml.append('<row><col><field ref="e%s"/></col></row>' % num)
+    xml.append('</form>')
+    xml.append('</configuration>')
+    return Config(parse("".join(xml)))
+
+
+def generate_dates_config():
+    """Will return a form configuration with a single form with the id
+    'dates' containing a date and a datetime field."""
+    xml = ('<configuration><source>'
+           '<entity id="e0" name="date" type="date"/>'
+           '<entity id="e1" name="datetime" type="datetime"/>'
+           '</source><form id="dates"><field ref="e0"/><field ref="e1"/>'
+           '</form></configuration>')
+    return Config(parse(xml)).get_form("dates")
+
+
+def generate_values(form_config):
+    values = {}
+    for name, field in form_config.get_fields().iteritems():
+        values[name] = VALUES[field.type]
+    return values
+
+
+Base = declarative_base()
+
+
+class Option(Base):
+    __tablename__ = 'options'
+    id = sa.Column(sa.Integer, primary_key=True)
+    name = sa.Column(sa.String)
+    description = sa.Column(sa.Text)
+
+    def __unicode__(self):
+        return self.name
+
+
+class Item(Base):
+    __tablename__ = 'items'
+    id = sa.Column(sa.Integer, primary_key=True)
+    option_id = sa.Column(sa.Integer, sa.ForeignKey('options.id'))
+    option = sa.orm.relationship(Option)
+
+
+def generate_options_config(label):
+    """Will return a form configuration with a single form with the id
+    'options' containing a dropdown for the option relation of
+    :class:`Item`."""
+    label = label and 'option_label="%s"' % label or ''
+    xml = ('<configuration><source>'
+           '<entity id="e0" name="option" type="manytoone">'
+           '<renderer type="dropdown" %s/></entity>'
+           '</source><form id="options"><field ref="e0"/></form>'
+           '</configuration>' % label)
+    return Config(parse(xml)).get_form("options")
+
+
+def load_options(num_options, number, label):
+    """Loads the options of a dropdown with `num_options` options
+    `number` times. Returns the minimum duration and the increase of the
+    maximum resident memory in kB."""
+    engine = sa.create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    description = u"x" * 500
+    with engine.begin() as connection:
+        for start in xrange(0, num_options, 1000):
+            end = min(start + 1000, num_options)
+            connection.execute(Option.__table__.insert(),
+                               [{"name": u"Option %s" % num,
+                                 "description": description}
+                                for num in xrange(start, end)])
+    session = sa.orm.sessionmaker(bind=engine)()
+    form_config = generate_options_config(label)
+    memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    def run():
+        form = Form(form_config, Item(), session)
+        form.get_field("option").get_options()
+        session.expunge_all()
+    duration = min(timeit.Timer(run).repeat(repeat=3, number=number))
+    memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - memory
+    return duration / number, memory
+
+
+def report(name, timer, number):
+    total = min(timer.repeat(repeat=3, number=number))
+    print "%-20s %10.3f ms/call" % (name, total / number * 1000)
+
+
+def bench_construct(form_config, args):
+    timer = timeit.Timer(lambda: Form(form_config))
+    report("construct", timer, args.number)
+
+
+def bench_validate(form_config, args):
+    values = generate_values(form_config)
+    prototype = FormPrototype(form_config)
+    timer = timeit.Timer(lambda: prototype.create().validate(values))
+    report("validate", timer, args.number)
+
+
+def bench_validate_data(form_config, args):
+    values = generate_values(form_config)
+    form = Form(form_config)
+    timer = timeit.Timer(lambda: form.validate_data(values))
+    report("validate_data", timer, args.number)
+
+
+def bench_convert(form_config, args):
+    values = generate_values(form_config)
+    form = Form(form_config)
+    converted = form.deserialize(values)
+    for name, convert, data in (("deserialize", form.deserialize, values),
+                                ("serialize", form.serialize, converted)):
+        timer = timeit.Timer(lambda: convert(data))
+        total = min(timer.repeat(repeat=3, number=args.number))
+        print "%-20s %10.1f values/s" % (name,
+                                         len(data) * args.number / total)
+
+
+def bench_dates(form_config, args):
+    config = generate_dates_config()
+    number = args.number * 1000
+    for locale in sorted(DATE_VALUES):
+        form = Form(config, locale=locale)
+        for dtype, value in sorted(DATE_VALUES[locale].iteritems()):
+            field = form.get_field(dtype)
+            converted = field.to_python(value)
+            for name, convert, data in (("parse", field.to_python, value),
+                                        ("format", field.from_python,
+                                         converted)):
+                timer = timeit.Timer(lambda: convert(data))
+                total = min(timer.repeat(repeat=3, number=number))
+                print "%-20s %10.1f values/s" % (
+                    "%s %s (%s)" % (name, dtype, locale), number / total)
+
+
+def generate_columns(rows):
+    """Will return a list of tuples with the name, the converter, the
+    column converter and a column of `rows` values per datatype. Dates
+    repeat like in typical exports."""
+    days = [u"1998-02-%02d" % (num % 28 + 1) for num in xrange(rows)]
+    return [("integer", converters.to_integer, converters.to_integer_column,
+             [unicode(num) for num in xrange(rows)]),
+            ("float", converters.to_float, converters.to_float_column,
+             [u"%s.5" % num for num in xrange(rows)]),
+            ("date", converters.to_date, converters.to_date_column, days),
+            ("datetime", converters.to_datetime,
+             converters.to_datetime_column,
+             [u"%s 12:30:00" % day for day in days])]
+
+
+def bench_columns(form_config, args):
+    for name, convert, convert_column, column in generate_columns(args.rows):
+        for variant, timer in (
+                ("values", timeit.Timer(lambda: [convert(v) for v in column])),
+                ("column", timeit.Timer(lambda: convert_column(column)))):
+            total = min(timer.repeat(repeat=3, number=1))
+            print "%-20s %10.3f ms/column" % ("%s (%s)" % (name, variant),
+                                              total * 1000)
+
+
+def bench_parallel(form_config, args):
+    values = generate_values(form_config)
+    for processes in range(1, args.workers + 1):
+        with ValidationPool(form_config, processes=processes,
+                            chunksize=args.chunksize) as pool:
+            start = time.time()
+            for result in pool.validate_many(values for i in xrange(args.records)):
+                pass
+            duration = time.time() - start
+        print "%-20s %10.1f records/s" % ("parallel (%s)" % processes,
+                                          args.records / duration)
+
+
+def bench_options(form_config, args):
+    # Run every variant in a fresh process to measure its memory usage.
+    for name, label in (("options (orm)", None), ("options (column)", "name")):
+        pool = multiprocessing.Pool(1)
+        duration, memory = pool.apply(load_options,
+                                      (args.options, args.number, label))
+        pool.close()
+        pool.join()
+        print "%-20s %10.3f ms/call %10d kB" % (name, duration * 1000, memory)
+
+
+def bench_render(form_config, args):
+    timer = timeit.Timer(lambda: Form(form_config).render())
+    report("render", timer, args.number)
+    # Render the layout of a prepared form with the template and the
+    # compiled render plan.
+    form = FormPrototype(form_config).create()
+    form.render()
+    for name, compiled in (("render (template)", False),
+                           ("render (plan)", True)):
+        renderer = FormRenderer(form, form._translate, compiled)
+        report(name, timeit.Timer(renderer.render), args.number)
+
+
+BENCHMARKS = {
+    "construct": bench_construct,
+    "validate": bench_validate,
+    "validate_data": bench_validate_data,
+    "convert": bench_convert,
+    "dates": bench_dates,
+    "columns": bench_columns,
+    "parallel": bench_parallel,
+    "options": bench_options,
+    "render": bench_render
+}
+
+
+def main(args):
+    config = generate_config(args.fields)
+    form_config = config.get_form("benchmark")
+    print "Benchmark with %s fields" % args.fields
+    for action in args.action:
+        BENCHMARKS[action](form_config, args)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run benchmarks on a generated form configuration')
+    parser.add_argument('action', nargs='+', choices=sorted(BENCHMARKS.keys()), help='Benchmark to run')
+    parser.add_argument('--fields', type=int, default=2000, help='Number of fields in the form')
+    parser.add_argument('--number', type=int, default=10, help='Number of calls per run')
+    parser.add_argument('--records', type=int, default=1000, help='Number of records for the parallel benchmark')
+    parser.add_argument('--chunksize', type=int, default=50, help='Number of records per chunk for the parallel benchmark')
+    parser.add_argument('--rows', type=int, default=1000000, help='Number of values per column for the columns benchmark')
+    parser.add_argument('--options', type=int, default=50000, help='Number of options for the options benchmark')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(), help='Maximum number of worker processes for the parallel benchmark')
+    args = parser.parse_args()
+    main(args)
+    sys.exit(0)
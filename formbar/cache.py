@@ -0,0 +1,142 @@
+"""Cache for the options of fields which are loaded from the database.
+By default the options of a field are loaded from the database on every
+rendering of the form. The :class:`.OptionCache` keeps the options
+across requests, so the options are only loaded once until the cache
+entry expires or is invalidated."""
+
+import time
+import logging
+import threading
+import collections
+from sqlalchemy import event
+
+log = logging.getLogger(__name__)
+
+
+class OptionCache(object):
+    """Size bounded cache with LRU eviction and a time to live for the
+    entries. The cache is thread safe and meant to be shared by all
+    forms of the application. See :class:`.FormPrototype` on how to use
+    the cache in a form.
+
+    The entries are keyed by the mapped class of the options and the
+    attributes of the options which are needed to filter the options.
+    The cached options are snapshots of the items, so they do not depend
+    on the database session they were loaded with. Filters of the
+    options are still applied on every rendering.
+
+    Entries can be invalidated explicitly using :meth:`invalidate` or
+    automatically after a commit by calling :meth:`listen` for the
+    session of the application::
+
+        cache = OptionCache(maxsize=100, ttl=300)
+        cache.listen(DBSession)
+    """
+
+    def __init__(self, maxsize=128, ttl=None):
+        """Initialize the cache.
+
+        :maxsize: Maximum number of entries in the cache. If the cache
+                  is full the least recently used entry is removed.
+        :ttl: Number of seconds the entries are valid. Defaults to None
+              (entries do not expire).
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        """Number of lookups which were answered from the cache."""
+        self.misses = 0
+        """Number of lookups which needed to load the options."""
+        self.evictions = 0
+        """Number of entries removed because the cache was full."""
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        # Incremented on every invalidation to detect options which
+        # have been loaded before the invalidation.
+        self._generation = 0
+
+    def get(self, key, loader):
+        """Returns the cached options for the given key. If there are no
+        valid options in the cache the options are loaded by calling the
+        given loader and stored in the cache. Options are not stored if
+        the cache has been invalidated while loading them, as they may
+        already be outdated.
+
+        :key: Tuple of the mapped class and further hashable values.
+        :loader: Callable without arguments which returns the options.
+        :returns: List of options.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None and (entry[0] is None or entry[0] > now):
+                self._entries[key] = entry
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generation
+        options = loader()
+        expires = now + self.ttl if self.ttl is not None else None
+        with self._lock:
+            if generation != self._generation:
+                return options
+            self._entries[key] = (expires, options)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return options
+
+    def invalidate(self, clazz=None):
+        """Will remove the entries for the given mapped class and the
+        classes of its inheritance hierarchy from the cache. If no class
+        is given all entries are removed.
+
+        :clazz: Mapped class.
+        """
+        with self._lock:
+            self._generation += 1
+            if clazz is None:
+                self._entries.clear()
+                return
+            for key in self._entries.keys():
+                if issubclass(key[0], clazz) or issubclass(clazz, key[0]):
+                    del self._entries[key]
+
+    def listen(self, session):
+        """Will register event handlers on the given session to
+        invalidate the entries of all classes which have been changed
+        when the session is committed.
+
+        :session: Session, sessionmaker or scoped_session
+        """
+        event.listen(session, "after_flush", self._collect_changes)
+        event.listen(session, "after_commit", self._invalidate_changes)
+
+    def _collect_changes(self, session, flush_context):
+        changed = session.info.setdefault("formbar_changed_classes", set())
+        for items in (session.new, session.dirty, session.deleted):
+            changed.update(type(item) for item in items)
+
+    def _invalidate_changes(self, session):
+        for clazz in session.info.pop("formbar_changed_classes", ()):
+            log.debug("Invalidate cached options for %s" % clazz)
+            self.invalidate(clazz)
+
+    @property
+    def hit_rate(self):
+        """Ratio of lookups which were answered from the cache."""
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            return 0.0
+        return float(self.hits) / lookups
+
+    def stats(self):
+        """Returns a dictionary with the metrics of the cache."""
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._entries),
+                "hit_rate": self.hit_rate}
+
+    def __len__(self):
+        return len(self._entries)
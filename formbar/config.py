@@ -253,14 +253,10 @@ def filter_form_fields(form, fields, values=None):
     conditional will evaluate to true using the given set of values."""
     if values is None:
         values = {}
-    # FIXME: The only way get only fields which are
-    # relevant (e.g in evaluable conditionals) is to "reinit"
-    # the fields.
-    filtered_fields = flatten_form_fields(form.init_fields(values,
-                                                           evaluate=True))
+    active_fields = form.get_active_fieldnames(values)
     tmp_fields = {}
     for fieldname, field in fields.iteritems():
-        if fieldname in filtered_fields:
+        if fieldname in active_fields:
             tmp_fields[fieldname] = field
     return tmp_fields
 
@@ -324,6 +320,11 @@ class Config(object):
         else:
             return None
 
+    def to_xml(self):
+        """Returns the XML of the configuration as string. Includes and
+        inheritance are already resolved in the returned XML."""
+        return ET.tostring(self._tree)
+
     def get_form(self, id):
         """Returns a :class:`.Form` instance with the configuration for a form
         with id in the configuration file. If the form can not be found a
@@ -393,6 +394,22 @@ class Form(Config):
         self._initialized = False
         """Flag to indicate that the form has been setup"""
 
+        self._conditionals = None
+        """Dictionary with a list of conditional paths per fieldname.
+        Every path is a tuple of the conditionals the field is nested
+        in. Build on first use. See :meth:`get_active_fieldnames`"""
+
+        self._conditional_rules = {}
+        """Dictionary with the Rule for every conditional"""
+
+        self._render_plans = {}
+        """Dictionary with the compiled :class:`.RenderPlan` of the form
+        with and without outline. See :func:`.get_render_plan`"""
+
+        self._loader_options = {}
+        """Dictionary with the SQLAlchemy loader options per mapped class
+        and page. See :func:`.loader_options`"""
+
         self._buttons = self.get_buttons()
         """Buttons of the form"""
         self._fields = self.init_fields()
@@ -404,6 +421,12 @@ class Form(Config):
         }
         """
 
+    def to_xml(self):
+        """Returns the XML of the whole configuration the form is part
+        of as string. The form can be build again from the XML with
+        ``Config(parse(xml)).get_form(id)``."""
+        return self._parent.to_xml()
+
     def get_buttons(self, root=None):
         # Get all Buttons for the form.
         buttons = []
@@ -489,6 +512,121 @@ class Form(Config):
             elif child.tag == "field":
                 yield child
 
+    def _walk_conditionals(self, root, conditionals=()):
+        """Will walk the tree recursivley like :meth:`walk` and yields
+        a tuple of every field node together with a tuple of the
+        conditionals the field node is nested in.
+
+        :root: Root node
+        :conditionals: Tuple of conditionals of the root node
+        :returns: yields tuples of field elements and conditionals
+
+        """
+        for child in root:
+            if len(child) > 0:
+                if child.tag == "if":
+                    path = conditionals + (child,)
+                else:
+                    path = conditionals
+                for elem in self._walk_conditionals(child, path):
+                    yield elem
+            elif child.tag == "snippet":
+                sref = child.attrib.get('ref')
+                if sref:
+                    snippet = self._parent.get_element('snippet', sref)
+                    for elem in self._walk_conditionals(snippet,
+                                                        conditionals):
+                        yield elem
+            elif child.tag == "field":
+                yield child, conditionals
+
+    def _init_conditionals(self):
+        conditionals = {}
+        pages = self.get_pages()
+        if len(pages) == 0:
+            pages.append(self._tree)
+        for page in pages:
+            for node, path in self._walk_conditionals(page):
+                name = self._id2name[node.attrib.get('ref')]
+                conditionals.setdefault(name, []).append(path)
+        return conditionals
+
+    def _evaluate_conditional(self, conditional, values):
+        rule = self._conditional_rules.get(conditional)
+        if rule is None:
+            rule = Rule(conditional.attrib.get('expr'))
+            self._conditional_rules[conditional] = rule
+        try:
+            return rule.evaluate(values)
+        except TypeError:
+            # See FIXME in walk. Rules referring to values which are
+            # not available are handled as inactive.
+            return False
+
+    def _get_conditionals(self):
+        if self._conditionals is None:
+            self._conditionals = self._init_conditionals()
+        return self._conditionals
+
+    def get_dependencies(self, fieldname):
+        """Returns a set with the names of the fields in the form which
+        are referenced in the rules of the field with the given name or
+        in the conditionals the field is nested in. Those values are
+        needed to evaluate the rules and conditionals of the field.
+
+        :fieldname: Name of the field
+        :returns: Set of fieldnames.
+        """
+        fields = self.get_fields()
+        expressions = [rule.attrib.get('expr', '') for rule
+                       in fields[fieldname]._tree.findall('rule')]
+        for path in self._get_conditionals().get(fieldname, []):
+            for conditional in path:
+                expressions.append(conditional.attrib.get('expr', ''))
+        dependencies = set()
+        for expr in expressions:
+            for variable in re.findall(r'\$[\.\w]+', expr):
+                variable = variable.strip("$")
+                if variable in fields:
+                    dependencies.add(variable)
+        return dependencies
+
+    def get_active_fieldnames(self, values, fieldnames=None):
+        """Returns a set with the names of all fields which are within
+        active conditionals. Active means the expression in the
+        conditional will evaluate to true using the given set of values.
+        A field which is included more than once in the form is active
+        if at least one of its occurrences is active.
+
+        The nesting of the conditionals is only determined once. Each
+        conditional is evaluated at most once per call.
+
+        :values: Dictionary with values which are used for evaluating
+        conditionals.
+        :fieldnames: Optional list of fieldnames. If given only the
+        conditionals of this fields are evaluated.
+        :returns: Set of fieldnames.
+        """
+        conditionals = self._get_conditionals()
+        if fieldnames is None:
+            fieldnames = conditionals.keys()
+        results = {}
+        active = set()
+        for name in fieldnames:
+            for path in conditionals.get(name, []):
+                for conditional in path:
+                    result = results.get(conditional)
+                    if result is None:
+                        result = self._evaluate_conditional(conditional,
+                                                            values)
+                        results[conditional] = result
+                    if not result:
+                        break
+                else:
+                    active.add(name)
+                    break
+        return active
+
     def init_fields(self, values=None, evaluate=False):
         """Will return the fields in the form as a dictionary. The
         dicionary will containe all fields per page to make the access
@@ -636,6 +774,21 @@ class Field(Config):
         string. This attribute is also used for Infofields to define the
         value which should be displayed (If no expression is defined)"""
 
+        maxsize = entity.attrib.get('maxsize')
+        self.maxsize = None
+        if maxsize:
+            try:
+                self.maxsize = int(maxsize)
+            except ValueError:
+                self.maxsize = -1
+            if self.maxsize < 0:
+                err = ('Invalid maxsize "%s" of entity "%s". The maxsize '
+                       'must be a number of bytes.' % (maxsize, self.id))
+                log.error(err)
+                raise ValueError(err)
+        """Maximum size of uploads in bytes. Only used for fields of the
+        datatype ``upload``. Defaults to None (no limit)."""
+
         self.tags = []
         """Tags of the field. Fields can have tags. Tags can be used to
         mark fields in the form and become handy if a application wants
@@ -693,13 +846,24 @@ class Field(Config):
             rules.append(Rule(expr, msg, mode, triggers))
         return rules
 
-    def get_validators(self):
+    def get_validators(self, options=False):
+        """Returns a list of tuples with the src and the message of the
+        configured validators. If options is True the tuples
+        additionally contain the concurrent flag and the timeout in
+        seconds (or None) of the validators."""
         validators = []
         for validator in self._tree.findall('validator'):
             # Import dynamically the validator
             src = validator.attrib.get("src")
             msg = validator.attrib.get("msg")
-            validators.append((src, msg))
+            if not options:
+                validators.append((src, msg))
+                continue
+            concurrent = validator.attrib.get("concurrent") == "true"
+            timeout = validator.attrib.get("timeout")
+            if timeout is not None:
+                timeout = float(timeout)
+            validators.append((src, msg, concurrent, timeout))
         return validators
 
 
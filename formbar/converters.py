@@ -6,10 +6,12 @@ value into a string are named `from_<datatype>`."""
 
 import logging
 import datetime
+import hashlib
+import tempfile
 import re
 import sqlalchemy as sa
-from babel.dates import format_datetime, format_date
-from formbar.helpers import get_local_datetime, get_utc_datetime
+from sqlalchemy.orm import class_mapper
+from formbar.helpers import get_local_datetime, get_utc_datetime, get_chunks
 from datetime import timedelta
 
 log = logging.getLogger(__name__)
@@ -110,13 +112,16 @@ def _split_time(value):
     return int(h), int(M), int(s)
 
 
-def to_datetime(value, locale=None):
+def to_datetime(value, locale=None, timezone=None):
     """Will return a python datetime instance for the given value. The
-    format of the value depends on the locale setting.
+    format of the value depends on the locale setting. The returned
+    datetime is in UTC without timezone information.
 
     :value: Datetime as string.
     :locale: Locale setting used to parse the date from the given value.
              Defaults to iso date format (YYYY-mm-DD HH:MM:SS)
+    :timezone: Timezone of the given value. Defaults to the local
+               timezone of the server. See :func:`.get_timezone`.
     :returns: Python datetime instance
 
     """
@@ -139,7 +144,7 @@ def to_datetime(value, locale=None):
         # datetimes if the date column isn't prepared. As
         # storing dates in UTC is a good idea anyway this is the
         # default.
-        converted = get_utc_datetime(converted)
+        converted = get_utc_datetime(converted, timezone)
         converted = converted.replace(tzinfo=None)
         return converted
     except:
@@ -161,6 +166,78 @@ def to_integer_list(value):
     return map(to_integer, [v for v in value if v not in ("", None)])
 
 
+IN_QUERY_SIZE = 500
+"""Maximum number of ids in a single IN query when loading related
+items."""
+
+
+def _get_from_identity_map(clazz, ids, db):
+    """Returns a tuple of a dictionary with the items of the given ids
+    which are already in the identity map of the session and a list of
+    the ids which are not."""
+    items = {}
+    missing = []
+    mapper = class_mapper(clazz)
+    for id in ids:
+        key = mapper.identity_key_from_primary_key([id])
+        item = db.identity_map.get(key)
+        if item is None:
+            missing.append(id)
+        else:
+            items[id] = item
+    return items, missing
+
+
+def _check_found(ids, found):
+    notfound = [id for id in ids if id not in found]
+    if notfound:
+        msg = _("Item(s) with id %s do not exist.")
+        raise DeserializeException(msg, ", ".join(map(str, notfound)))
+
+
+def load_items(clazz, ids, db):
+    """Will return a dictionary with the items of the given class for the
+    given ids. Items which are already in the identity map of the session
+    are taken from there. All other items are loaded with one IN query
+    (per IN_QUERY_SIZE ids). If not all items can be found a
+    DeserializeException is raised.
+
+    :clazz: Mapped class of the items.
+    :ids: List of ids of the items.
+    :db: Database session.
+    :returns: Dictionary with the id as key and the item as value.
+
+    """
+    items, missing = _get_from_identity_map(clazz, ids, db)
+    for chunk in get_chunks(missing, IN_QUERY_SIZE):
+        for item in db.query(clazz).filter(clazz.id.in_(chunk)):
+            items[item.id] = item
+    _check_found(ids, items)
+    return items
+
+
+def check_items(clazz, ids, db):
+    """Will check if items of the given class exist for all given ids.
+    Unlike :func:`load_items` only the ids of items which are not in the
+    identity map of the session are queried. If not all items exist a
+    DeserializeException is raised. If no session is given the check is
+    skipped.
+
+    :clazz: Mapped class of the items.
+    :ids: List of ids of the items.
+    :db: Database session.
+
+    """
+    if db is None:
+        return
+    items, missing = _get_from_identity_map(clazz, ids, db)
+    found = set(items)
+    for chunk in get_chunks(missing, IN_QUERY_SIZE):
+        for id, in db.query(clazz.id).filter(clazz.id.in_(chunk)):
+            found.add(id)
+    _check_found(ids, found)
+
+
 def to_manytomany(clazz, ids, db, selected):
     # The selected values must be in a list. So make sure they are a
     # list.
@@ -175,8 +252,9 @@ def to_manytomany(clazz, ids, db, selected):
     delete_ids = selected_ids.difference(ids)
 
     related_items = filter(lambda x: x.id not in delete_ids, selected)
-    for id in add_ids:
-        related_items.append(db.query(clazz).filter(clazz.id == id).one())
+    if add_ids:
+        items = load_items(clazz, add_ids, db)
+        related_items.extend(items[id] for id in add_ids)
     return related_items
 
 
@@ -186,10 +264,100 @@ def to_onetomany(clazz, ids, db, selected):
 
 def to_manytoone(clazz, id, db, selected):
     if not selected or selected.id != id:
-        return db.query(clazz).filter(clazz.id == id).one()
+        return load_items(clazz, [id], db)[id]
     return selected
 
 
+class RelationReference(object):
+    """Reference to the related items of a relation. The references are
+    the result of the deserialization of relations. They behave like
+    the ids of the related items, so rules can be evaluated without
+    loading the related items. The items are loaded on :meth:`load`
+    which is called when the form is saved. Loading uses the database
+    session of the form and therefor must happen in the thread of the
+    form.
+
+    Subclasses define the function which loads the related items in
+    :attr:`loader`, the related items of an unknown item in
+    :attr:`default` and return the ids passed to the loader in
+    ``get_ids()``."""
+
+    loader = None
+    """Function called with the mapped class, the ids, the database
+    session and the currently related items to load the related
+    items."""
+    default = None
+    """Currently related items if the item is not known."""
+
+    def _init_reference(self, clazz, db, item, name):
+        # The attributes are private to not hide the attributes of the
+        # related item (see :class:`RelatedId`).
+        self._clazz = clazz
+        self._db = db
+        self._item = item
+        self._name = name
+        self._loaded = None
+
+    def get_selected(self):
+        """Returns the currently related items of the item."""
+        if self._item is None:
+            return self.default
+        return getattr(self._item, self._name)
+
+    def load(self):
+        """Returns the related items for the references. The items are
+        only loaded once."""
+        if self._loaded is None:
+            self._loaded = self.loader(self._clazz, self.get_ids(),
+                                       self._db, self.get_selected())
+        return self._loaded
+
+
+class RelatedId(RelationReference, int):
+    """Reference to the related item of a manytoone relation. Accessing
+    an attribute of the reference (e.g ``data['user'].name`` in a
+    validator) loads the related item and returns its attribute."""
+
+    loader = staticmethod(to_manytoone)
+
+    def __new__(cls, clazz, id, db, item=None, name=None):
+        obj = int.__new__(cls, id)
+        obj._init_reference(clazz, db, item, name)
+        return obj
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+    @property
+    def id(self):
+        return int(self)
+
+    def get_ids(self):
+        return int(self)
+
+
+class RelatedIds(RelationReference, list):
+    """References to the related items of a onetomany or manytomany
+    relation. The related items are available as list in
+    :attr:`items`."""
+
+    loader = staticmethod(to_manytomany)
+    default = []
+
+    def __init__(self, clazz, ids, db, item=None, name=None):
+        list.__init__(self, ids)
+        self._init_reference(clazz, db, item, name)
+
+    @property
+    def items(self):
+        return self.load()
+
+    def get_ids(self):
+        return list(self)
+
+
 def to_string(value):
     try:
         # Actually all submitted values are strings.
@@ -199,6 +367,13 @@ def to_string(value):
         raise DeserializeException(msg, value)
 
 
+# Range for integer values taken from
+# http://www.postgresql.org/docs/9.1/static/datatype-numeric.html
+# for integer type.
+MIN_INTEGER = -2147483648
+MAX_INTEGER = 2147483647
+
+
 def to_integer(value):
     """Converts a given string value into a 4 byte integer value. If
     the given value is larger the a 4 byte integer a OverflowError is
@@ -207,10 +382,7 @@ def to_integer(value):
         return None
     try:
         value = int(value)
-        # Range for value taken from
-        # http://www.postgresql.org/docs/9.1/static/datatype-numeric.html
-        # for integer type.
-        if -2147483648 <= value <= 2147483647:
+        if MIN_INTEGER <= value <= MAX_INTEGER:
             return value
         else:
             raise OverflowError
@@ -263,18 +435,254 @@ def to_file(value):
         raise DeserializeException(msg, value)
 
 
-def from_python(field, value):
+FILE_CHUNK_SIZE = 64 * 1024
+"""Number of bytes which are read at once when copying uploads."""
+
+SPOOL_SIZE = 1024 * 1024
+"""Maximum number of bytes of an upload which are kept in memory. Larger
+uploads are written into a temporary file on disk."""
+
+
+class UploadedFile(object):
+    """Upload which has been copied into a temporary file. The file is
+    kept in memory up to SPOOL_SIZE bytes and written to disk beyond
+    that. The size and the SHA256 hash of the content are computed while
+    copying. Uploaded files are the result of the deserialization of
+    fields of the datatype ``upload``."""
+
+    def __init__(self, filename=None, content_type=None):
+        self.filename = filename
+        """Name of the file as submitted by the client."""
+        self.content_type = content_type
+        """Content type of the file as submitted by the client."""
+        self.size = 0
+        """Size of the file in bytes."""
+        self.file = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+        """File object with the content of the upload."""
+        self._hash = hashlib.sha256()
+
+    @property
+    def sha256(self):
+        """Hex digest of the SHA256 hash of the content."""
+        return self._hash.hexdigest()
+
+    def write(self, data):
+        self.file.write(data)
+        self.size += len(data)
+        self._hash.update(data)
+
+    def read(self, size=-1):
+        return self.file.read(size)
+
+    def seek(self, offset, whence=0):
+        self.file.seek(offset, whence)
+
+    def close(self):
+        self.file.close()
+
+
+def to_uploaded_file(value, max_size=None, chunk_size=FILE_CHUNK_SIZE):
+    """Will return a :class:`UploadedFile` with the content of the given
+    upload. Unlike :func:`to_file` the content is copied in chunks, so
+    the upload is never loaded into memory as a whole. If the upload is
+    larger than the given maximum size a DeserializeException is raised
+    as soon as the size is exceeded.
+
+    :value: Submitted upload (e.g cgi.FieldStorage) with a file
+            attribute.
+    :max_size: Maximum size of the upload in bytes. Defaults to None
+               (no limit).
+    :chunk_size: Number of bytes to read at once.
+    :returns: :class:`UploadedFile` positioned at the start of the file
+              or None if no file was submitted.
+    """
+    try:
+        infile = value.file
+    except AttributeError:
+        return None
+    uploaded = UploadedFile(getattr(value, "filename", None),
+                            getattr(value, "type", None))
+    while True:
+        chunk = infile.read(chunk_size)
+        if not chunk:
+            break
+        if max_size is not None and uploaded.size + len(chunk) > max_size:
+            uploaded.close()
+            msg = _("File is larger than %s bytes.")
+            raise DeserializeException(msg, max_size)
+        uploaded.write(chunk)
+    uploaded.seek(0)
+    return uploaded
+
+
+def _convert_column(convert, values):
+    """Converts the given values using the given converter. Each
+    distinct value is only converted once. Returns a tuple of the list
+    with the converted values and a dictionary with the
+    :class:`DeserializeException` per row which could not be converted.
+    The converted value of these rows is None."""
+    converted = []
+    errors = {}
+    results = {}
+    for num, value in enumerate(values):
+        try:
+            result = results[value]
+        except KeyError:
+            try:
+                result = convert(value)
+            except DeserializeException, e:
+                result = e
+            results[value] = result
+        if isinstance(result, DeserializeException):
+            errors[num] = result
+            result = None
+        converted.append(result)
+    return converted, errors
+
+
+def to_integer_column(values):
+    """Converts a sequence of strings into integers like
+    :func:`to_integer`. Column converters are meant for bulk imports of
+    many values of the same datatype. They return a tuple of the list
+    with the converted values and a dictionary with the
+    :class:`DeserializeException` per row number for the values which
+    could not be converted (the converted value of these rows is
+    None).
+
+    :values: Sequence of strings
+    :returns: Tuple of list and dictionary
+    """
+    try:
+        converted = map(int, values)
+    except (ValueError, TypeError):
+        return _convert_column(to_integer, values)
+    if converted and (min(converted) < MIN_INTEGER
+                      or max(converted) > MAX_INTEGER):
+        return _convert_column(to_integer, values)
+    return converted, {}
+
+
+def to_float_column(values):
+    """Converts a sequence of strings into floats like :func:`to_float`.
+    See :func:`to_integer_column`."""
+    try:
+        return map(float, values), {}
+    except (ValueError, TypeError):
+        return _convert_column(to_float, values)
+
+
+def to_boolean_column(values):
+    """Converts a sequence of strings into booleans like
+    :func:`to_boolean`. See :func:`to_integer_column`."""
+    return _convert_column(to_boolean, values)
+
+
+def to_date_column(values, locale=None):
+    """Converts a sequence of strings into dates like :func:`to_date`.
+    See :func:`to_integer_column`."""
+    return _convert_column(lambda value: to_date(value, locale), values)
+
+
+def to_datetime_column(values, locale=None, timezone=None):
+    """Converts a sequence of strings into datetimes like
+    :func:`to_datetime`. See :func:`to_integer_column`."""
+    return _convert_column(lambda value: to_datetime(value, locale,
+                                                     timezone), values)
+
+
+def to_timedelta_column(values):
+    """Converts a sequence of strings into timedeltas like
+    :func:`to_timedelta`. See :func:`to_integer_column`."""
+    return _convert_column(to_timedelta, values)
+
+
+RELATION_TYPES = ('manytoone', 'onetomany', 'manytomany')
+"""Datatypes of relations. Lists are deserialized as a whole for
+relations and element by element for all other datatypes."""
+
+_deserializers = {}
+"""Dictionary with the deserializers. The key is the datatype."""
+
+_serializers = {}
+"""Dictionary with the serializers. The key is the datatype."""
+
+
+def register_converter(dtype, deserialize=None, serialize=None):
+    """Registers the converters for the datatype with the given name.
+    The datatype can be used in the type attribute of entities in the
+    form configuration. Registering a converter for an existing
+    datatype will replace the builtin converter.
+
+    :dtype: Name of the datatype
+    :deserialize: Callable which is called with the field and a single
+                  submitted value and returns the python value. Raise
+                  :class:`DeserializeException` if the value can not be
+                  converted.
+    :serialize: Callable which is called with the field and a single
+                python value and returns the serialized value. It is
+                not called for None, strings, lists and related items.
+    """
+    if deserialize is not None:
+        _deserializers[dtype] = deserialize
+    if serialize is not None:
+        _serializers[dtype] = serialize
+
+
+def _to_none(field, value):
+    return None
+
+
+def _from_value(field, value):
+    return value
+
+
+def get_deserializer(dtype):
+    """Returns the deserializer for the given datatype. The returned
+    callable is called with the field and a submitted value and returns
+    the python value. Lists of values are deserialized element by
+    element except for relations. Unknown datatypes are deserialized
+    into None.
+
+    :dtype: Name of the datatype
+    :returns: Python callable
+    """
+    deserialize = _deserializers.get(dtype, _to_none)
+    if dtype in RELATION_TYPES:
+        return deserialize
+
+    def deserialize_values(field, value):
+        if isinstance(value, list):
+            # Special handling for multiple values (multiselect in
+            # checkboxes eg.)
+            return [deserialize_values(field, v) for v in value]
+        return deserialize(field, value)
+    return deserialize_values
+
+
+def get_serializer(dtype):
+    """Returns the serializer for the given datatype. Values of unknown
+    datatypes are not converted. See :func:`from_python`.
+
+    :dtype: Name of the datatype
+    :returns: Python callable
+    """
+    return _serializers.get(dtype, _from_value)
+
+
+def from_python(field, value, serialize=None):
     """Will return the serialised version of the value the given field
     and value.
 
     :field: :class:`.Field` instance
     :value: Python value
+    :serialize: Serializer for the datatype of the field. Defaults to
+                the registered serializer. See :func:`get_serializer`.
     :returns: Serialized version.
 
     """
     serialized = ""
-    locale = field._form._locale
-    ftype = field.get_type()
+    if serialize is None:
+        serialize = get_serializer(field.get_type())
     try:
         if value is None:
             serialized = u""
@@ -287,7 +695,7 @@ def from_python(field, value):
             if value.startswith("{") and value.endswith("}"):
                 serialized = []
                 for v in value.strip("{").strip("}").split(","):
-                    serialized.append(from_python(field, v))
+                    serialized.append(from_python(field, v, serialize))
             else:
                 serialized = unicode(value)
         elif isinstance(value, list):
@@ -302,93 +710,118 @@ def from_python(field, value):
             try:
                 serialized = value.id
             except AttributeError:
-                if ftype == "time":
-                    td = datetime.timedelta(seconds=int(value))
-                    serialized = from_timedelta(td)
-                elif ftype == "interval":
-                    serialized = from_timedelta(value)
-                elif ftype == "datetime":
-                    value = get_local_datetime(value)
-                    if locale == "de":
-                        dateformat = "dd.MM.yyyy HH:mm:ss"
-                    else:
-                        dateformat = "yyyy-MM-dd HH:mm:ss"
-                    serialized = format_datetime(value, format=dateformat)
-                elif ftype == "date":
-                    if locale == "de":
-                        dateformat = "dd.MM.yyyy"
-                    else:
-                        dateformat = "yyyy-MM-dd"
-                    serialized = format_date(value, format=dateformat)
-                else:
-                    serialized = value
+                serialized = serialize(field, value)
     except AttributeError:
         log.warning('Can not get value for field "%s". '
                     'The field is no attribute of the item' % field.name)
     return serialized
 
 
-def to_python(field, value, relation_names):
+def to_python(field, value, relation_names=None):
     """Will return a instance of a python value of the value the given
-    field and value.
+    field and value. The value is converted with the registered
+    deserializer for the datatype of the field. See
+    :func:`get_deserializer`.
 
     :field: :class:`.Field` instance
     :value: Serialized version of the value
+    :relation_names: Not used anymore. The relations are taken from
+                     the form of the field.
     :returns: Instance of a python type
     """
+    return get_deserializer(field.get_type())(field, value)
 
-    dtype = field.get_type()
-    if isinstance(value, list) and dtype not in ['manytomany',
-                                                 'manytoone',
-                                                 'onetomany']:
-        # Special handling for multiple values (multiselect in
-        # checkboxes eg.)
-        tmp_list = []
-        for v in value:
-            tmp_list.append(to_python(field, v, relation_names))
-        return tmp_list
-    if dtype in ['string', 'text']:
-        return to_string(value)
-    elif dtype == 'integer':
-        return to_integer(value)
-    elif dtype == 'float':
-        return to_float(value)
-    elif dtype == 'email':
-        return to_email(value)
-    elif dtype == 'boolean':
-        return to_boolean(value)
-    elif dtype == 'file':
-        return to_file(value)
-    elif dtype == 'date':
-        return to_date(value, field._form._locale)
-    elif dtype == 'time':
-        return to_timedelta(value).total_seconds()
-    elif dtype == 'interval':
-        return to_timedelta(value)
-    elif dtype == 'datetime':
-        return to_datetime(value, field._form._locale)
-    # Reltation handling
-    elif dtype == 'manytoone':
-        rel = relation_names[field.name].mapper.class_
-        if value in ("", None):
-            return None
-        value = to_integer(value)
-        db = field._form._dbsession
-        selected = getattr(field._form._item, field.name)
-        return to_manytoone(rel, value, db, selected)
-    elif dtype == 'onetomany':
-        rel = relation_names[field.name].mapper.class_
-        value = to_integer_list(value)
-        if not value:
-            return value
-        db = field._form._dbsession
-        selected = getattr(field._form._item, field.name)
-        return to_onetomany(rel, value, db, selected)
-    elif dtype in 'manytomany':
-        rel = relation_names[field.name].mapper.class_
-        value = to_integer_list(value)
-        if not value:
-            return value
-        db = field._form._dbsession
-        selected = getattr(field._form._item, field.name)
-        return to_manytomany(rel, value, db, selected)
+
+def _from_time(field, value):
+    return from_timedelta(datetime.timedelta(seconds=int(value)))
+
+
+def _from_interval(field, value):
+    return from_timedelta(value)
+
+
+def from_date(value, locale=None):
+    """Will return the serialised value for the given date (or
+    datetime) in the date format of the locale. See :func:`to_date`."""
+    if locale == "de":
+        return u"%02d.%02d.%04d" % (value.day, value.month, value.year)
+    return u"%04d-%02d-%02d" % (value.year, value.month, value.day)
+
+
+def from_datetime(value, locale=None, timezone=None):
+    """Will return the serialised value for the given datetime in the
+    given timezone and the datetime format of the locale. Naive
+    datetimes are assumed to be in UTC. See :func:`to_datetime`."""
+    value = get_local_datetime(value, timezone)
+    return u"%s %02d:%02d:%02d" % (from_date(value, locale), value.hour,
+                                   value.minute, value.second)
+
+
+def _from_datetime(field, value):
+    return from_datetime(value, field._form._locale, field._form._timezone)
+
+
+def _from_date(field, value):
+    return from_date(value, field._form._locale)
+
+
+def _to_upload(field, value):
+    return to_uploaded_file(value, field._config.maxsize)
+
+
+def _from_upload(field, value):
+    return getattr(value, "filename", None) or u""
+
+
+def _get_related_class(field):
+    return field._form._get_relation_names()[field.name].mapper.class_
+
+
+# Reltation handling
+# Relations are deserialized into references. The related items
+# are only loaded when the form is saved.
+def _to_related_id(field, value):
+    rel = _get_related_class(field)
+    if value in ("", None):
+        return None
+    value = to_integer(value)
+    db = field._form._dbsession
+    check_items(rel, [value], db)
+    return RelatedId(rel, value, db, field._form._item, field.name)
+
+
+def _to_related_ids(field, value):
+    rel = _get_related_class(field)
+    value = to_integer_list(value)
+    if not value:
+        return value
+    db = field._form._dbsession
+    check_items(rel, value, db)
+    return RelatedIds(rel, value, db, field._form._item, field.name)
+
+
+register_converter('string', lambda field, value: to_string(value))
+register_converter('text', lambda field, value: to_string(value))
+register_converter('integer', lambda field, value: to_integer(value))
+register_converter('float', lambda field, value: to_float(value))
+register_converter('email', lambda field, value: to_email(value))
+register_converter('boolean', lambda field, value: to_boolean(value))
+register_converter('file', lambda field, value: to_file(value))
+register_converter('upload', _to_upload, _from_upload)
+register_converter('date',
+                   lambda field, value: to_date(value, field._form._locale),
+                   _from_date)
+register_converter('time',
+                   lambda field, value: to_timedelta(value).total_seconds(),
+                   _from_time)
+register_converter('interval',
+                   lambda field, value: to_timedelta(value),
+                   _from_interval)
+register_converter('datetime',
+                   lambda field, value: to_datetime(value,
+                                                    field._form._locale,
+                                                    field._form._timezone),
+                   _from_datetime)
+register_converter('manytoone', _to_related_id)
+register_converter('onetomany', _to_related_ids)
+register_converter('manytomany', _to_related_ids)
@@ -1,18 +1,33 @@
 import logging
 import inspect
 import re
+import os
+import math
+import time
+import operator
+import numbers
+import decimal
+import collections
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 import sqlalchemy as sa
-import importlib
-from formbar.renderer import FormRenderer, get_renderer
-from formbar.rules import Rule, Expression
+from formbar.renderer import FormRenderer, get_renderer, index_options
+from formbar.helpers import get_chunks, get_timezone
+from formbar.validators import get_validator
+from formbar.rules import Expression, FilterTemplate, rule_value
 from formbar.converters import (
-    DeserializeException, from_python, to_python
+    DeserializeException, RelationReference, RelatedId, RelatedIds,
+    from_python, get_deserializer, get_serializer
 )
 
 import config
 
 log = logging.getLogger(__name__)
 
+# Dummy translation function.
+_ = lambda x: x
+
 
 def remove_ws(data):
     """Helper function which removes trailing and leading whitespaces
@@ -40,6 +55,31 @@ def get_relations(cls):
             if isinstance(prop, sa.orm.RelationshipProperty)]
 
 
+def loader_options(config, clazz, page=None):
+    """Returns a list of SQLAlchemy loader options to load an item of
+    the given mapped class with all the attributes needed by the form.
+    See :meth:`.FormPrototype.loader_options`::
+
+        options = loader_options(form_config, User)
+        item = DBSession.query(User).options(*options).get(id)
+
+    The options are cached in the form configuration per class and
+    page, so keep the configuration (or a :class:`FormPrototype`) across
+    requests to benefit from the cache.
+
+    :config: FormConfiguration.
+    :clazz: Mapped class of the item.
+    :page: Optional page element or number of the page.
+    :returns: List of loader options.
+    """
+    key = (clazz, page)
+    options = config._loader_options.get(key)
+    if options is None:
+        options = FormPrototype(config).loader_options(clazz, page)
+        config._loader_options[key] = options
+    return options
+
+
 class Error(Exception):
     """Base class for exceptions in this module."""
     pass
@@ -55,10 +95,162 @@ class StateError(Error):
         self.msg = msg
 
 
+class SearchError(Error):
+    """Exception raised for invalid parameters of an option search. See
+    :meth:`Form.search_options`.
+
+        :msg:  explanation of the error
+    """
+
+    def __init__(self, msg):
+        Error.__init__(self, msg)
+        self.msg = msg
+
+
 class ValidationException(Exception):
     pass
 
 
+class FilterTranslationError(Exception):
+    """Raised if a filter expression can not be translated into SQL."""
+    pass
+
+
+FILTER_OPERATORS = {
+    "eq": operator.eq, "==": operator.eq,
+    "ne": operator.ne, "!=": operator.ne,
+    "lt": operator.lt, "<": operator.lt,
+    "le": operator.le, "<=": operator.le,
+    "gt": operator.gt, ">": operator.gt,
+    "ge": operator.ge, ">=": operator.ge
+}
+"""Operators of filter expressions which can be translated into SQL."""
+
+FILTER_NUMBER_RE = re.compile(r"^-?[0-9.]+$")
+
+OPTION_PAGESIZE = 50
+"""Default number of options per page when searching options."""
+
+OPTION_LABEL_RE = re.compile(r"%(\w+)")
+"""Variables in the template for the labels of options."""
+
+
+def _get_id(value):
+    return getattr(value, "id", value)
+
+
+def is_changed(old, new):
+    """Returns True if the new value of a field differs from the old
+    value of the item. Relations are compared by the ids of the related
+    items. Decimals are compared with floats by the decimal value of
+    the float. Other values are only equal if they are of the same kind
+    (numbers, strings or the same type) and compare equal.
+
+    :old: Value of the item
+    :new: Converted value of the field
+    :returns: True or False
+    """
+    if isinstance(new, RelatedIds):
+        return set(_get_id(v) for v in old or []) != set(new)
+    if isinstance(new, RelatedId):
+        return _get_id(old) != int(new)
+    if isinstance(old, list) and isinstance(new, list):
+        return map(_get_id, old) != map(_get_id, new)
+    if isinstance(old, decimal.Decimal) and isinstance(new, float):
+        # Values of Numeric columns are decimals while the converted
+        # values are floats which never equal the decimal exactly.
+        return old != decimal.Decimal(repr(new))
+    for kind in (numbers.Number, basestring):
+        if isinstance(old, kind) and isinstance(new, kind):
+            break
+    else:
+        if type(old) is not type(new):
+            return True
+    try:
+        return not old == new
+    except TypeError:
+        # e.g comparing naive and timezone aware datetimes.
+        return True
+
+
+def _unicode_or_empty(value):
+    if value is None:
+        return u""
+    return unicode(value)
+
+
+VALIDATOR_THREADS = 10
+"""Default number of threads used to run concurrent validators. See
+:func:`set_validator_threads`."""
+
+_thread_pool = None
+"""Tuple of the process id and the :class:`ValidatorThreadPool` for
+concurrent validators."""
+
+
+class ValidatorThreadPool(object):
+    """Thread pool for concurrent validators which keeps track of the
+    validators in flight. Validators which timed out can not be
+    cancelled and keep their thread busy until they return. To prevent
+    those from starving all later validations the pool does not queue
+    further validators once all threads are in use, see
+    :meth:`submit`. The caller runs these validators in its own
+    thread instead."""
+
+    def __init__(self, threads):
+        self.threads = threads
+        """Number of threads of the pool."""
+        self.in_flight = 0
+        """Number of validators which are queued or running."""
+        self._pool = ThreadPool(threads)
+        self._lock = threading.Lock()
+
+    def submit(self, validator, data, context):
+        """Starts the evaluation of the given validator in the pool.
+        Returns an AsyncResult or None if all threads are in use."""
+        with self._lock:
+            if self.in_flight >= self.threads:
+                return None
+            self.in_flight += 1
+        return self._pool.apply_async(self._evaluate,
+                                      (validator, data, context))
+
+    def _evaluate(self, validator, data, context):
+        try:
+            return validator.evaluate(data, context)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def close(self):
+        """Stops the threads after the running validators returned."""
+        self._pool.close()
+
+
+def get_thread_pool():
+    """Returns the :class:`ValidatorThreadPool` used to run concurrent
+    validators. The pool is created on first usage and recreated in
+    forked processes."""
+    global _thread_pool
+    pid = os.getpid()
+    if _thread_pool is None or _thread_pool[0] != pid:
+        _thread_pool = (pid, ValidatorThreadPool(VALIDATOR_THREADS))
+    return _thread_pool[1]
+
+
+def set_validator_threads(threads):
+    """Sets the number of threads used to run concurrent validators.
+    The current pool is closed after its running validators returned.
+
+    :threads: Number of threads
+    """
+    global VALIDATOR_THREADS, _thread_pool
+    VALIDATOR_THREADS = threads
+    if _thread_pool is not None and _thread_pool[0] == os.getpid():
+        _thread_pool[1].close()
+    _thread_pool = None
+
+
 class Validator(object):
     """Validator class for external validators. External validators can
     be used to implement more complicated validations on the converted
@@ -66,9 +258,16 @@ class Validator(object):
     of the form. Validation happens on the converted pythonic values
     from the submitted formdata. Additionally a context can be provided
     to the validator to provide additional data needed for the
-    validation."""
+    validation.
+
+    Validators which are I/O bound (e.g doing requests to other
+    services) can be marked as concurrent. Concurrent validators of a
+    form are run at the same time in a thread pool. Note that concurrent
+    validators must be thread safe and therefor must not use the
+    database session of the form."""
 
-    def __init__(self, field, error, callback, context=None, triggers="error"):
+    def __init__(self, field, error, callback, context=None, triggers="error",
+                 concurrent=False, timeout=None):
         """Initialize a new Validator
 
         :field: Name of the field which should be validated.
@@ -79,6 +278,11 @@ class Validator(object):
         :triggers: Set what kind of error message will be generated.
                    Everything else than "error" will trigger a warning
                    message. Default to error.
+        :concurrent: Flag to run the validator concurrently with other
+                     concurrent validators. Defaults to False.
+        :timeout: Number of seconds to wait for the result of a
+                  concurrent validator. If the timeout expires the
+                  validation fails. Defaults to None (wait forever).
 
         """
         self._field = field
@@ -86,19 +290,361 @@ class Validator(object):
         self._callback = callback
         self._context = context
         self._triggers = triggers
+        self._concurrent = concurrent
+        self._timeout = timeout
+        self._use_context = len(inspect.getargspec(callback).args) != 2
 
     def check(self, data):
         """Checker method which will call the callback of the validator
         to actually do the validation on the provided data. Will return
         True or False."""
+        result, self._error = self.evaluate(data, self._context)
+        return result
+
+    def evaluate(self, data, context=None):
+        """Will call the callback of the validator with the given data
+        and context and returns a tuple of the result and the error
+        message. Unlike :meth:`check` the validator is not changed, so
+        the same validator can be used to check different data.
+
+        :data: Dictionary with the converted values.
+        :context: Additional data which is provided to the callback.
+        :returns: Tuple of True or False and the error message.
+        """
         try:
-            if len(inspect.getargspec(self._callback).args) == 2:
-                return self._callback(self._field, data)
+            if self._use_context:
+                return self._callback(self._field, data, context), self._error
             else:
-                return self._callback(self._field, data, self._context)
+                return self._callback(self._field, data), self._error
         except ValidationException, e:
-            self._error = e.message
-            return False
+            return False, e.message
+
+
+class FieldDict(collections.Mapping):
+    """Read only mapping of fieldnames to :class:`.Field` instances.
+    The Field instances (and their renderers) are not created on
+    initialisation but on first access of the field. This way forms
+    which are only used to validate data or to render a single page will
+    only build the fields which are actually needed."""
+
+    def __init__(self, form, configs):
+        """Initialize the mapping.
+
+        :form: :class:`.Form` instance the fields belong to.
+        :configs: Dictionary with :class:`formbar.config.Field`
+                  instances. The key is the name of the field.
+
+        """
+        self._form = form
+        self._configs = configs
+        self._fields = {}
+
+    def __getitem__(self, name):
+        field = self._fields.get(name)
+        if field is None:
+            field = Field(self._form, self._configs[name],
+                          self._form._translate)
+            self._fields[name] = field
+        return field
+
+    def __iter__(self):
+        return iter(self._configs)
+
+    def __len__(self):
+        return len(self._configs)
+
+    def __contains__(self, name):
+        return name in self._configs
+
+    def loaded(self):
+        """Returns a list of all fields which has been created so far.
+        Fields which has not been accessed yet can not have any errors
+        or warnings and do not need to be checked."""
+        return self._fields.values()
+
+
+class ValidationResult(object):
+    """Result of a validation done with :meth:`.Form.validate_data`.
+    Errors and warnings are dictionaries with a list of messages per
+    fieldname. Form wide messages are stored with an empty string as key
+    (like in :meth:`.Form.get_errors`)."""
+
+    __slots__ = ("data", "errors", "warnings")
+
+    def __init__(self, data, errors, warnings):
+        """Initialize the result.
+
+        :data: Dictionary with the converted values.
+        :errors: Dictionary with errors
+        :warnings: Dictionary with warnings
+        """
+        self.data = data
+        if None in errors:
+            errors[""] = errors.pop(None)
+        self.errors = errors
+        if None in warnings:
+            warnings[""] = warnings.pop(None)
+        self.warnings = warnings
+
+    @property
+    def valid(self):
+        """True if the validation did not result in any errors."""
+        return len(self.errors) == 0
+
+    def __repr__(self):
+        return "<ValidationResult valid: {} errors: {} warnings: {}>".format(
+            self.valid, self.errors, self.warnings)
+
+
+class FormPrototype(object):
+    """Prototype for :class:`.Form` instances. The prototype holds all
+    parts of a form which do not change between requests like the
+    configuration, the pages, the rules and the validators of the
+    fields. It is meant to be build once per form configuration,
+    renderers and locale and to be kept by the application.
+
+    Calling :meth:`create` will return a new :class:`.Form` which
+    shares all the immutable parts with the prototype and only allocates
+    the per request state (values, errors, warnings and the current
+    page).
+    """
+
+    def __init__(self, config, translate=None, renderers=None, locale=None,
+                 option_cache=None, timezone=None):
+        """Initialize the prototype.
+
+        :config: FormConfiguration.
+        :translate: Translation function which returns a translated
+        string for a given msgid
+        :renderers: A optional dictionary of custom renderers. See
+        :class:`.Form`
+        :locale: String of the locale of the form. Defaults to "en".
+        :option_cache: Optional :class:`.OptionCache` for the options
+        of the fields which are loaded from the database.
+        :timezone: Timezone in which datetimes are displayed and
+        submitted (eg. "Europe/Berlin"). Defaults to the local timezone
+        of the server.
+        """
+        self._config = config
+        self.option_cache = option_cache
+        """Cache for options loaded from the database."""
+        self._translate = translate or (lambda msgid: msgid)
+        self._locale = locale or "en"
+        self._timezone = get_timezone(timezone)
+        self.external_renderers = renderers or {}
+        """Dictionary with external provided custom renderers."""
+        self.fields = config.get_fields()
+        """Dictionary with the configuration of all fields in the form."""
+        self.pages = config.get_pages()
+        """List of pages in the form."""
+        self.last_page = None
+        """Number of the last configured page"""
+        if self.pages:
+            self.last_page = [int(p.attrib.get("id").strip("p"))
+                              for p in self.pages][-1]
+        self.external_validators = []
+        """List with external validators which are added to every
+        form created by this prototype."""
+        self._rules = {}
+        self._validators = {}
+        self._page_scopes = {}
+        self._load_scopes = {}
+        self._filter_templates = {}
+        self._loader_options = {}
+
+    def get_rules(self, name):
+        """Returns the list of rules for the field with the given name.
+        The rules are build on the first call and are cached
+        afterwards."""
+        rules = self._rules.get(name)
+        if rules is None:
+            rules = self.fields[name].get_rules()
+            self._rules[name] = rules
+        return rules
+
+    def get_validators(self, name):
+        """Returns the list of :class:`.Validator` for the validators
+        configured for the field with the given name. The callables of
+        the validators are resolved on the first call and the validators
+        are cached afterwards."""
+        validators = self._validators.get(name)
+        if validators is None:
+            configs = self.fields[name].get_validators(options=True)
+            validators = [Validator(name, msg, get_validator(src),
+                                    concurrent=concurrent, timeout=timeout)
+                          for src, msg, concurrent, timeout in configs]
+            self._validators[name] = validators
+        return validators
+
+    def get_filter_template(self, name):
+        """Returns the :class:`.FilterTemplate` for the filter of the
+        options of the field with the given name or None if the field
+        has no filter. The template is cached after the first call."""
+        if name not in self._filter_templates:
+            renderer = self.fields[name].renderer
+            template = None
+            if renderer is not None and renderer.filter:
+                template = FilterTemplate(renderer.filter)
+            self._filter_templates[name] = template
+        return self._filter_templates[name]
+
+    def get_page(self, page):
+        """Returns the page element for the given page. The page can be
+        either given as page element or as number of the page. The
+        number refers to the id of the page (e.g 2 for the page with the
+        id "p2"). If the page can not be found a KeyError is raised."""
+        if not isinstance(page, (int, long)):
+            return page
+        page_id = "p%s" % page
+        for element in self.pages:
+            if element.attrib.get("id") == page_id:
+                return element
+        raise KeyError('Page "%s" can not be found' % page_id)
+
+    def get_page_scope(self, page):
+        """Returns a tuple of two sets for the given page. The first set
+        contains the names of the fields on the page. The second set
+        additionally contains the names of the fields which are needed
+        to evaluate the rules and conditionals of the fields on the
+        page. The sets are cached per page.
+
+        :page: Page element or number of the page
+        :returns: Tuple with set of fieldnames on the page and set of
+                  fieldnames needed to validate the page.
+        """
+        page = self.get_page(page)
+        scope = self._page_scopes.get(page)
+        if scope is None:
+            fieldnames = set(self._config.get_fields(page))
+            needed = set(fieldnames)
+            for name in fieldnames:
+                needed.update(self._config.get_dependencies(name))
+            scope = (fieldnames, needed)
+            self._page_scopes[page] = scope
+        return scope
+
+    def get_load_scope(self, page):
+        """Returns a set with the names of the fields whose values are
+        needed to render or validate the given page. Besides the fields
+        of the page scope (see :meth:`get_page_scope`) these are the
+        fields referenced in the default value expressions and in the
+        option filters of the fields on the page. The set is cached per
+        page.
+
+        :page: Page element or number of the page
+        :returns: Set of fieldnames.
+        """
+        page = self.get_page(page)
+        scope = self._load_scopes.get(page)
+        if scope is None:
+            fieldnames, needed = self.get_page_scope(page)
+            scope = set(needed)
+            for name in fieldnames:
+                variables = []
+                value = self.fields[name].value
+                if value and value.startswith("%"):
+                    variables.extend(re.findall(r'\$([\.\w]+)', value))
+                template = self.get_filter_template(name)
+                if template is not None:
+                    variables.extend(param[1:] for key, param
+                                     in template.params
+                                     if param.startswith("$"))
+                scope.update(v for v in variables if v in self.fields)
+            self._load_scopes[page] = scope
+        return scope
+
+    def _get_item_attributes(self, fieldnames):
+        """Returns a set with the names of the attributes of the item
+        which are read by the default values (``$attr``) and the option
+        filters (``@attr``) of the given fields. For attributes of
+        related items (``@attr.name``) the name of the relation is
+        returned.
+
+        :fieldnames: Iterable with names of fields.
+        :returns: Set of attribute names.
+        """
+        variables = []
+        for name in fieldnames:
+            value = self.fields[name].value
+            if value and value.startswith("$"):
+                variables.append(value.strip("$"))
+            template = self.get_filter_template(name)
+            if template is not None:
+                variables.extend(param[1:] for key, param in template.params
+                                 if param.startswith("@"))
+        return set(v.split(".")[0] for v in variables)
+
+    def loader_options(self, clazz, page=None):
+        """Returns a list of SQLAlchemy loader options to load an item of
+        the given mapped class with all the attributes needed by the
+        form in a few queries instead of lazy loading each relation
+        while the form reads the values of the item.
+
+        Many to one relations are loaded with a join, collections are
+        loaded with one additional SELECT ... IN query per relation. The
+        columns of the item are restricted to the columns of the fields
+        and the attributes of the item read by their default values
+        (``$attr``) and option filters (``@attr``). If a page is given,
+        only the fields whose values are needed for the page are
+        included (see :meth:`get_load_scope`). Attributes which are not
+        mapped (e.g properties) and dynamic relations are ignored. The
+        options are cached per class and page.
+
+        :clazz: Mapped class of the item.
+        :page: Optional page element or number of the page.
+        :returns: List of loader options.
+        """
+        if page is not None:
+            page = self.get_page(page)
+        key = (clazz, page)
+        options = self._loader_options.get(key)
+        if options is None:
+            if page is None:
+                fieldnames = self.fields.keys()
+            else:
+                fieldnames = self.get_load_scope(page)
+            names = set(fieldnames) | self._get_item_attributes(fieldnames)
+            mapper = sa.orm.class_mapper(clazz)
+            columns = set()
+            options = []
+            for name in sorted(names):
+                prop = mapper.attrs.get(name)
+                if isinstance(prop, sa.orm.ColumnProperty):
+                    columns.add(name)
+                elif isinstance(prop, sa.orm.RelationshipProperty):
+                    if prop.lazy == "dynamic":
+                        continue
+                    # Columns of the item needed to load the relation.
+                    for column in prop.local_columns:
+                        column = mapper.get_property_by_column(column)
+                        columns.add(column.key)
+                    if prop.uselist:
+                        loader = sa.orm.selectinload
+                    else:
+                        loader = sa.orm.joinedload
+                    options.append(loader(getattr(clazz, name)))
+            columns = [getattr(clazz, column) for column in sorted(columns)]
+            options.insert(0, sa.orm.load_only(*columns))
+            self._loader_options[key] = options
+        return options
+
+    def add_validator(self, validator):
+        return self.external_validators.append(validator)
+
+    def create(self, item=None, dbsession=None, change_page_callback={},
+               request=None, csrf_token=None, eval_url=None,
+               url_prefix="", values=None, search_url=None, page=None):
+        """Returns a new :class:`.Form` instance for the given item. See
+        :class:`.Form` for a description of the parameters.
+
+        :returns: :class:`.Form` instance
+        """
+        return Form(self._config, item, dbsession,
+                    change_page_callback=change_page_callback,
+                    request=request, csrf_token=csrf_token,
+                    eval_url=eval_url, url_prefix=url_prefix,
+                    values=values, prototype=self, search_url=search_url,
+                    page=page)
 
 
 class Form(object):
@@ -120,7 +666,8 @@ class Form(object):
     def __init__(self, config, item=None, dbsession=None, translate=None,
                  change_page_callback={}, renderers={}, request=None,
                  csrf_token=None, eval_url=None, url_prefix="", locale=None,
-                 values=None):
+                 values=None, prototype=None, search_url=None, page=None,
+                 timezone=None):
         """Initialize the form with ``Form`` configuration instance and
         optional an SQLAlchemy mapped object.
 
@@ -151,7 +698,24 @@ class Form(object):
         display of the date and number functions.
         :values: Dictionary with values to be prefilled/overwritten in
                  the rendered form.
+        :prototype: :class:`.FormPrototype` for the given config. If
+                    provided the translate, renderers and locale
+                    settings of the prototype are used. Usually you
+                    do not need to set it yourself but call
+                    :meth:`.FormPrototype.create`.
+        :search_url: External URL to search the options of fields with
+        a renderer in search mode. See :meth:`search_options`.
+        :page: Optional page element or number of the page the form is
+        scoped to. A scoped form only reads the values needed for this
+        page from the item, only renders this page and validates only
+        this page by default.
+        :timezone: Timezone in which datetimes are displayed and
+        submitted. Defaults to the local timezone of the server.
         """
+        if prototype is None:
+            prototype = FormPrototype(config, translate, renderers, locale,
+                                      timezone=timezone)
+        self._prototype = prototype
         self._config = config
         self._item = item
         self._dbsession = dbsession
@@ -161,26 +725,26 @@ class Form(object):
         self._eval_url = eval_url
         if self._url_prefix:
             self._eval_url = self._url_prefix + self._eval_url
+        self._search_url = search_url
+        if self._url_prefix and self._search_url:
+            self._search_url = self._url_prefix + self._search_url
+        self.page_scope = None
+        """Page element the form is scoped to or None."""
+        if page is not None:
+            self.page_scope = prototype.get_page(page)
 
-        if locale:
-            self._locale = locale
-        else:
-            self._locale = "en"
-
-        if translate:
-            self._translate = translate
-        else:
-            self._translate = lambda msgid: msgid
+        self._locale = prototype._locale
+        self._timezone = prototype._timezone
+        self._translate = prototype._translate
 
         self.validated = False
         """Flag to indicate if the form has been validated. Init value
         is False.  which means no validation has been done."""
-        self.external_validators = []
+        self.external_validators = list(prototype.external_validators)
         """List with external validators. Will be called an form validation."""
         self.current_page = 0
         """Number of the currently selected page"""
-        if self.pages:
-            self.last_page = [int(p.attrib.get("id").strip("p")) for p in self.pages][-1]
+        self.last_page = prototype.last_page
         """Number of the last configured page"""
         self.change_page_callback = change_page_callback
         """Dictionary with some parameters used to call an URL when the
@@ -193,7 +757,7 @@ class Form(object):
         The url will have the additional parameter "page" which holds
         the currently selected page.
         """
-        self.external_renderers = renderers
+        self.external_renderers = prototype.external_renderers
         """Dictionary with external provided custom renderers."""
         self.fields = self._build_fields()
         """Dictionary with fields."""
@@ -204,15 +768,10 @@ class Form(object):
         self.submitted_data = {}
         """The submitted data from the user. If validation fails, then
         this values are used to rerender the form."""
-        self.loaded_data = self._get_data_from_item()
-        """This is the initial data loaded from the given item. Used to
-        render the readonly forms"""
-        if not values:
-            values = {}
-        self.merged_data = dict(self.loaded_data.items() + values.items())
-        """This is merged date from the initial data loaded from the
-        given item and userprovided values on form initialisation. The
-        user defined values are merged again on render time"""
+        self._loaded_data = None
+        self._merged_data = None
+        self._relation_names = None
+        self._values = values or {}
         self.warnings = []
         """Form wide warnings. This list contains warnings which affect
         the entire form and not specific fields. These warnings are show
@@ -222,6 +781,45 @@ class Form(object):
         the entire form and not specific fields. These errors are show
         at the top of evere page."""
 
+    @property
+    def loaded_data(self):
+        """This is the initial data loaded from the given item. Used to
+        render the readonly forms. The values are read from the item
+        only once on first access and are shared e.g by all default
+        value expressions of the fields."""
+        if self._loaded_data is None:
+            self._loaded_data = self._get_data_from_item()
+        return self._loaded_data
+
+    @property
+    def changed_fields(self):
+        """Dictionary with the fields whose validated value differs from
+        the value loaded from the item. The values are tuples with the
+        loaded and the validated value. Fields of relations contain the
+        ids of the related items as validated value. See
+        :func:`is_changed`. The dictionary is empty if the form has not
+        been validated."""
+        changed = {}
+        for key, value in self.data.iteritems():
+            old = self.loaded_data.get(key)
+            if is_changed(old, value):
+                changed[key] = (old, value)
+        return changed
+
+    @property
+    def merged_data(self):
+        """This is merged date from the initial data loaded from the
+        given item and userprovided values on form initialisation. The
+        user defined values are merged again on render time"""
+        if self._merged_data is None:
+            self._merged_data = dict(self.loaded_data.items()
+                                     + self._values.items())
+        return self._merged_data
+
+    @merged_data.setter
+    def merged_data(self, data):
+        self._merged_data = data
+
     def _set_current_field_data(self, data):
         for key in self.fields:
             value = data.get(key)
@@ -240,7 +838,11 @@ class Form(object):
         values = {}
         if not self._item:
             return values
-        for name, field in self._config.get_fields().iteritems():
+        if self.page_scope is not None:
+            fieldnames = self._prototype.get_load_scope(self.page_scope)
+        else:
+            fieldnames = self._prototype.fields
+        for name in fieldnames:
             try:
                 values[name] = getattr(self._item, name)
             except AttributeError:
@@ -257,7 +859,7 @@ class Form(object):
 
         """
         filtered = {}
-        for fieldname, field in self.fields.iteritems():
+        for fieldname in self.fields:
             if fieldname in values:
                 filtered[fieldname] = values[fieldname]
         return filtered
@@ -272,10 +874,17 @@ class Form(object):
         :returns: Dictionary with deserialized data
 
         """
-        deserialized = {}
+        errors = {}
+        deserialized = self._deserialize(data, errors)
+        self._add_messages(errors, self._add_error)
+        return deserialized
 
-        # Load relations of the item. Those are needed to deserialize
-        # the relations.
+    def _get_relation_names(self):
+        """Returns a dictionary with the relation properties of the
+        item. Those are needed to deserialize the relations. The
+        relations are only determined once per form."""
+        if self._relation_names is not None:
+            return self._relation_names
         relation_names = {}
         try:
             mapper = sa.orm.object_mapper(self._item)
@@ -290,18 +899,28 @@ class Form(object):
                 pass  # The form is not mapped to an item.
             else:
                 raise
+        self._relation_names = relation_names
+        return relation_names
+
+    def _deserialize(self, data, errors):
+        """Returns a dictionary with pythonized data like
+        :meth:`deserialize` but does not change the state of the form.
+        Conversion errors are collected in the given errors dictionary.
 
+        :data: Dictionary with serialized data
+        :errors: Dictionary with a list of errors per fieldname
+        :returns: Dictionary with deserialized data
+
+        """
+        deserialized = {}
         for fieldname, value in self._filter_values(data).iteritems():
             field = self.fields.get(fieldname)
             try:
-                serialized = data.get(field.name)
-                deserialized[fieldname] = to_python(field,
-                                                    serialized,
-                                                    relation_names)
+                deserialized[fieldname] = field.to_python(value)
             except DeserializeException as ex:
-                self._add_error(field.name,
-                                self._translate(ex.message) % ex.value)
-        log.debug("Deserialized values: %s" % deserialized)
+                msg = self._translate(ex.message) % ex.value
+                errors.setdefault(fieldname, []).append(msg)
+        log.debug("Deserialized values: %s", deserialized)
         return deserialized
 
     def serialize(self, data):
@@ -318,35 +937,33 @@ class Form(object):
         serialized = {}
         for fieldname, value in self._filter_values(data).iteritems():
             field = self.fields.get(fieldname)
-            serialized[fieldname] = from_python(field, value)
+            serialized[fieldname] = field.from_python(value)
         log.debug("Serialized values: %s" % serialized)
         return serialized
 
     def _build_fields(self):
         """Returns a dictionary with all Field instances which are
-        configured for this form.
-        :returns: Dictionary with Field instances
+        configured for this form. The Field instances are created lazy
+        on first access.
+        :returns: :class:`.FieldDict` with Field instances
 
         """
-        fields = {}
-        for name, field in self._config.get_fields().iteritems():
-            fields[name] = Field(self, field, self._translate)
-        return fields
+        return FieldDict(self, self._prototype.fields)
 
     @property
     def pages(self):
-        return self._config.get_pages()
+        return self._prototype.pages
 
     def has_errors(self):
         """Returns True if one of the fields in the form has errors"""
-        for field in self.fields.values():
+        for field in self.fields.loaded():
             if len(field.get_errors()) > 0:
                 return True
         return len(self.errors) != 0
 
     def has_warnings(self):
         """Returns True if one of the fields in the form has warnings"""
-        for field in self.fields.values():
+        for field in self.fields.loaded():
             if len(field.get_warnings()) > 0:
                 return True
         return len(self.warnings) != 0
@@ -366,7 +983,7 @@ class Form(object):
             fields_on_page = self._config.get_fields(page)
 
         errors = {}
-        for field in self.fields.values():
+        for field in self.fields.loaded():
             if page is not None and field.name not in fields_on_page:
                 continue
             if len(field.get_errors()) > 0:
@@ -390,7 +1007,7 @@ class Form(object):
             fields_on_page = self._config.get_fields(page)
 
         warnings = {}
-        for field in self.fields.values():
+        for field in self.fields.loaded():
             if page is not None and field.name not in fields_on_page:
                 continue
             if len(field.get_warnings()) > 0:
@@ -402,6 +1019,38 @@ class Form(object):
     def get_field(self, name):
         return self.fields[name]
 
+    def search_options(self, params, pagesize=OPTION_PAGESIZE):
+        """Helper for the endpoint behind the *search_url* of the form.
+        Returns a JSON serializable dictionary with a page of the options
+        of a field matching a search term. See
+        :meth:`Field.search_options` for the format of the result.
+
+        A :class:`SearchError` is raised if the field is not in the form
+        or its renderer is not in search mode or if the page is no
+        number or negative.
+
+        :params: Dictionary with the request parameters "field" (name
+                 of the field), "term" (search term) and optional
+                 "page" (number of the page starting with 0).
+        :pagesize: Number of options per page.
+        :returns: Dictionary with the options.
+        """
+        name = params.get("field")
+        field = self.fields.get(name)
+        if field is None:
+            raise SearchError("Field '%s' is not in the form" % name)
+        renderer = field._config.renderer
+        if not (renderer and renderer.search == "true"):
+            raise SearchError("Options of field '%s' can not be searched"
+                              % name)
+        try:
+            page = int(params.get("page", 0))
+        except (TypeError, ValueError):
+            page = -1
+        if page < 0:
+            raise SearchError("Page '%s' is invalid" % params.get("page"))
+        return field.search_options(params.get("term", u""), page, pagesize)
+
     def add_validator(self, validator):
         return self.external_validators.append(validator)
 
@@ -411,6 +1060,9 @@ class Form(object):
 
         :values: Dictionary with values to be prefilled/overwritten in
                  the rendered form.
+        :page: Number of the active page. Like in :meth:`get_page` the
+               number refers to the id of the page. Defaults to the
+               page the form is scoped to.
         :previous_values: Dictionary of values of the last saved state
                           of the item. If provided a diff between the
                           current and previous values will be renderered
@@ -420,6 +1072,8 @@ class Form(object):
         :returns: Rendered form.
 
         """
+        if not page and self.page_scope is not None:
+            page = int(self.page_scope.attrib.get("id").strip("p"))
         self.current_page = page
 
         # Merge the items_values with the extra provided values. Extra
@@ -450,6 +1104,11 @@ class Form(object):
         form = renderer.render(buttons=buttons, outline=outline)
         return form
 
+    def renders_page(self, page):
+        """Returns True if the given page element is rendered. If the
+        form is scoped to a page only this page is rendered."""
+        return self.page_scope is None or page is self.page_scope
+
     def _add_error(self, fieldname, error):
         if fieldname is None:
             self.errors.append(error)
@@ -472,7 +1131,15 @@ class Form(object):
             else:
                 field.add_warning(warning)
 
-    def validate(self, submitted=None):
+    def _add_messages(self, messages, add):
+        """Will add all messages of the given dictionary with a list of
+        messages per fieldname using the given add function. Messages for
+        the fieldname None are form wide messages."""
+        for fieldname, msgs in messages.iteritems():
+            for msg in msgs:
+                add(fieldname, msg)
+
+    def validate(self, submitted=None, page=None):
         """Returns True if the validation succeeds else False.
         Validation of the data happens in three stages:
 
@@ -494,10 +1161,21 @@ class Form(object):
         are stored in the data dictionary. In case there has been errors
         the dictionary will contain the origin submitted data.
 
+        If a page is given, only the fields on this page are validated.
+        Only the values of those fields and of the fields referenced in
+        their rules and conditionals are converted. Validators which are
+        not bound to a field on the page are not called. The data
+        dictionary will only contain the converted values of these
+        fields.
+
         :submitted: Dictionary with submitted values.
+        :page: Optional page element or number of the page to validate.
+               Defaults to the page the form is scoped to.
         :returns: True or False
 
         """
+        if page is None:
+            page = self.page_scope
 
         if not submitted:
             unvalidated = self.serialize(self.merged_data)
@@ -509,16 +1187,122 @@ class Form(object):
             unvalidated = remove_ws(unvalidated)
             log.debug("Submitted data: %s" % unvalidated)
             self.submitted_data = unvalidated
-        converted = self.deserialize(unvalidated)
+        errors = {}
+        warnings = {}
+        converted = self._validate(unvalidated, errors, warnings, page)
+        self._add_messages(errors, self._add_error)
+        self._add_messages(warnings, self._add_warning)
+
+        # If the form is valid. Save the converted and validated data
+        # into the data dictionary.
+        has_errors = self.has_errors()
+        if not has_errors:
+            self.data = converted
+        self.validated = True
+        return not has_errors
+
+    def validate_data(self, data, page=None):
+        """Returns a :class:`.ValidationResult` for the given
+        dictionary. Validation is done in the same stages as in
+        :meth:`validate` but without any bookkeeping needed for
+        rendering the form: The submitted data is not stored, errors and
+        warnings are not added to the fields and the state of the form
+        is not changed. Therefor the method can be called many times on
+        the same form instance. This is the preferred way to validate
+        data if the form is not rendered afterwards (e.g JSON clients).
+
+        Leading and trailing whitespaces are removed from the values
+        like in :meth:`validate`. Values which are not part of the form
+        are ignored and are not available for the evaluation of rules.
+
+        :data: Dictionary with submitted values.
+        :page: Optional page element or number of the page to validate.
+               See :meth:`validate`.
+        :returns: :class:`.ValidationResult`
+
+        """
+        if page is None:
+            page = self.page_scope
+        unvalidated = {}
+        for fieldname, value in data.iteritems():
+            if fieldname not in self.fields:
+                continue
+            if isinstance(value, unicode):
+                value = value.strip()
+            unvalidated[fieldname] = value
+        errors = {}
+        warnings = {}
+        converted = self._validate(unvalidated, errors, warnings, page)
+        return ValidationResult(converted, errors, warnings)
+
+    def validate_many(self, records, chunksize=None):
+        """Generator which validates every record of the given iterable
+        with :meth:`validate_data` and yields a
+        :class:`.ValidationResult` per record in the order of the
+        records. The records are consumed lazy and no results are kept
+        by the form, so the memory usage does not depend on the number
+        of records. This is useful to validate large imports (e.g CSV
+        or JSON-lines files) against a form configuration.
+
+        If chunksize is given, the records are processed in chunks of
+        up to chunksize records and a list of results is yielded per
+        chunk. This can be used to e.g commit the imported items per
+        chunk.
+
+        :records: Iterable with dictionaries of submitted values.
+        :chunksize: Optional number of records per chunk.
+        :returns: yields :class:`.ValidationResult` or lists of those.
+
+        """
+        if chunksize:
+            for chunk in get_chunks(records, chunksize):
+                yield [self.validate_data(record) for record in chunk]
+        else:
+            for record in records:
+                yield self.validate_data(record)
+
+    def _add_message(self, messages, fieldname, msg):
+        messages.setdefault(fieldname, []).append(msg)
+
+    def _validate(self, unvalidated, errors, warnings, page=None):
+        """Will convert and validate the given values and returns the
+        converted values. See :meth:`validate` for the stages of the
+        validation. All errors and warnings are collected in the given
+        dictionaries with a list of messages per fieldname. Form wide
+        messages are stored under the fieldname None.
+
+        :unvalidated: Dictionary with submitted values.
+        :errors: Dictionary for errors
+        :warnings: Dictionary for warnings
+        :page: Optional page element or number of the page to validate.
+        :returns: Dictionary with converted values.
+
+        """
+        if page is not None:
+            fieldnames, needed = self._prototype.get_page_scope(page)
+            unvalidated = dict((key, value)
+                               for key, value in unvalidated.iteritems()
+                               if key in needed)
+            # Fields which are only needed by rules and conditionals are
+            # not on the page. If they can't be converted they are
+            # handled as missing.
+            conversion_errors = {}
+            converted = self._deserialize(unvalidated, conversion_errors)
+            for fieldname, msgs in conversion_errors.iteritems():
+                if fieldname in fieldnames:
+                    errors.setdefault(fieldname, []).extend(msgs)
+        else:
+            fieldnames = None
+            converted = self._deserialize(unvalidated, errors)
 
         # Validate the fields. Ignore fields which are disabled in
         # conditionals First get list of fields which are still in the
         # form after conditionals has be evaluated
-        fields_to_check = self._config.get_fields(values=converted,
-                                                  evaluate=True)
-        for fieldname, field in fields_to_check.iteritems():
-            field = self.fields[fieldname]
-            for rule in field.get_rules():
+        fields_to_check = self._config.get_active_fieldnames(converted,
+                                                             fieldnames)
+        checks = []
+        for fieldname in fields_to_check:
+            for rule in self._prototype.get_rules(fieldname):
                 if rule.mode == "pre":
                     result = rule.evaluate(unvalidated)
                 elif fieldname not in converted:
@@ -528,20 +1312,12 @@ class Form(object):
                     result = rule.evaluate(converted)
                 if not result:
                     if rule.triggers == "warning":
-                        self._add_warning(fieldname, rule.msg)
-                    else:
-                        self._add_error(fieldname, rule.msg)
-
-            for src, msg in field.get_validators():
-                src = src.split(".")
-                checker = getattr(importlib.import_module(".".join(src[0:-1])),
-                                  src[-1])
-                validator = Validator(fieldname, msg, checker, self)
-                if not validator.check(converted):
-                    if validator._triggers == "error":
-                        self._add_error(validator._field, validator._error)
+                        self._add_message(warnings, fieldname, rule.msg)
                     else:
-                        self._add_warning(validator._field, validator._error)
+                        self._add_message(errors, fieldname, rule.msg)
+
+            for validator in self._prototype.get_validators(fieldname):
+                checks.append((validator, self))
 
         # Custom validation. User defined external validators.
         for validator in self.external_validators:
@@ -549,19 +1325,82 @@ class Form(object):
                     and validator._field is not None):
                 # Ignore validator if the value can't be converted.
                 continue
-            if not validator.check(converted):
+            if fieldnames is not None and validator._field not in fieldnames:
+                # Ignore validator if the field is not on the page.
+                continue
+            checks.append((validator, validator._context))
+        self._check_validators(checks, converted, errors, warnings)
+        if fieldnames is not None:
+            converted = dict((key, value)
+                             for key, value in converted.iteritems()
+                             if key in fieldnames)
+        return converted
+
+    def _check_validators(self, checks, converted, errors, warnings):
+        """Will run the given validators and add their messages to the
+        errors and warnings. Concurrent validators are started first and
+        run in the thread pool while the other validators are checked.
+        The timeout of a concurrent validator counts from its start. If
+        it expires the validation fails with the message "Validation
+        timed out" instead of the message of the validator, as the check
+        did not finish. If all threads of the pool are in use, concurrent
+        validators are checked in the current thread. The messages are
+        added in the order of the given validators regardless of the
+        order in which the validators finish. If there are concurrent
+        validators, the related items of relations are loaded before the
+        validators are started.
+
+        :checks: List of tuples with the validator and its context.
+        :converted: Dictionary with converted values.
+        :errors: Dictionary for errors
+        :warnings: Dictionary for warnings
+        """
+        results = [None] * len(checks)
+        pending = []
+        synchronous = []
+        if any(validator._concurrent for validator, context in checks):
+            # Load the related items in the current thread, as
+            # concurrent validators must not use the database session.
+            for value in converted.itervalues():
+                if isinstance(value, RelationReference):
+                    value.load()
+        for num, (validator, context) in enumerate(checks):
+            if not validator._concurrent:
+                synchronous.append(num)
+                continue
+            async_result = get_thread_pool().submit(validator, converted,
+                                                    context)
+            if async_result is not None:
+                # The timeout counts from the submission of the
+                # validator.
+                deadline = None
+                if validator._timeout is not None:
+                    deadline = time.time() + validator._timeout
+                pending.append((num, async_result, deadline))
+            else:
+                log.warning("No thread left for the validator of %s. "
+                            "Checking it in the current thread."
+                            % validator._field)
+                synchronous.append(num)
+        for num in synchronous:
+            validator, context = checks[num]
+            results[num] = validator.evaluate(converted, context)
+        for num, async_result, deadline in pending:
+            validator = checks[num][0]
+            timeout = None
+            if deadline is not None:
+                timeout = max(0, deadline - time.time())
+            try:
+                results[num] = async_result.get(timeout)
+            except multiprocessing.TimeoutError:
+                log.warning("Validator for %s timed out" % validator._field)
+                results[num] = (False, _("Validation timed out"))
+        for (validator, context), (result, error) in zip(checks, results):
+            if not result:
                 if validator._triggers == "error":
-                    self._add_error(validator._field, validator._error)
+                    self._add_message(errors, validator._field, error)
                 else:
-                    self._add_warning(validator._field, validator._error)
-
-        # If the form is valid. Save the converted and validated data
-        # into the data dictionary.
-        has_errors = self.has_errors()
-        if not has_errors:
-            self.data = converted
-        self.validated = True
-        return not has_errors
+                    self._add_message(warnings, validator._field, error)
 
     def save(self):
         """Will save the validated data back into the item. In case of
@@ -579,7 +1418,15 @@ class Form(object):
         if self._item is not None:
             # TODO: Iterate over fields here. Fields should know their value
             # and if they are a relation or not (torsten) <2013-07-24 23:24>
-            for key, value in self.data.iteritems():
+            data = self.data
+            if self._item.id:
+                # Only assign the values which have been changed to
+                # avoid needless updates of existing items.
+                data = dict((key, new) for key, (old, new)
+                            in self.changed_fields.iteritems())
+            for key, value in data.iteritems():
+                if isinstance(value, RelationReference):
+                    value = value.load()
                 setattr(self._item, key, value)
             # If the item has no id, then we assume it is a new item. So
             # add it to the database session.
@@ -613,19 +1460,30 @@ class Field(object):
         """
         self._form = form
         self._config = config
-        self.sa_property = self._get_sa_property()
+        self._sa_property = None
+        self._has_sa_property = False
         self._translate = translate
-        self.renderer = get_renderer(self, translate)
+        self._renderer = None
         self._errors = []
         self._warnings = []
-        # Set default value
+        self._value = None
+        self._has_value = False
+        self._deserialize = None
+        self._serialize = None
+
+        self.previous_value = None
+        """Value as string of the field. Will be set on rendering the
+        form"""
+
+    def _get_default_value(self):
+        """Returns the configured default value of the field."""
         value = getattr(self._config, "value")
 
         # If value begins with '%' then consider the following string as
         # a brabbel expression and set the value of the default value to
         # the result of the evaluation of the expression.
         if value and value.startswith("%"):
-            form_values = self._form._get_data_from_item()
+            form_values = self._form.loaded_data
             value = Expression(value.strip("%")).evaluate(values=form_values)
         # If value begins with '$' then consider the string as attribute
         # name of the item in the form and get the value
@@ -645,11 +1503,29 @@ class Field(object):
                     log.error("Error while accessing attribute '%s': %s"
                               % (value, e))
                 value = None
-        self.value = value
+        return value
 
-        self.previous_value = None
-        """Value as string of the field. Will be set on rendering the
-        form"""
+    @property
+    def value(self):
+        """Value of the field. If no value has been set yet the
+        configured default value is evaluated on first access."""
+        if not self._has_value:
+            self._value = self._get_default_value()
+            self._has_value = True
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        self._value = value
+        self._has_value = True
+
+    @property
+    def renderer(self):
+        """Renderer of the field. The renderer is created on first
+        access."""
+        if self._renderer is None:
+            self._renderer = get_renderer(self, self._translate)
+        return self._renderer
 
     @property
     def rules_to_string(self):
@@ -667,8 +1543,25 @@ class Field(object):
 
     def __getattr__(self, name):
         """Make attributes from the configuration directly available"""
+        prop = getattr(type(self), name, None)
+        if isinstance(prop, property):
+            # Python falls back to __getattr__ if a property raises an
+            # AttributeError. Evaluate the property again so the error
+            # surfaces instead of the configuration attribute with the
+            # same name.
+            return prop.fget(self)
         return getattr(self._config, name)
 
+    @property
+    def sa_property(self):
+        """SQLAlchemy property of the item for this field. None if there
+        is no item or the item has no property with the name of the
+        field."""
+        if not self._has_sa_property:
+            self._sa_property = self._get_sa_property()
+            self._has_sa_property = True
+        return self._sa_property
+
     def _get_sa_mapped_class(self):
         # TODO: Raise Exception if this field is not a relation. (None)
         # <2013-07-25 07:44>
@@ -704,9 +1597,37 @@ class Field(object):
                 return self.sa_property.direction.name.lower()
         return "string"
 
+    def to_python(self, value):
+        """Returns the python value of the given serialized value. The
+        deserializer for the datatype of the field is looked up once
+        (see :func:`formbar.converters.get_deserializer`).
+
+        :value: Serialized value
+        :returns: Python value
+        """
+        if self._deserialize is None:
+            self._deserialize = get_deserializer(self.get_type())
+        return self._deserialize(self, value)
+
+    def from_python(self, value):
+        """Returns the serialized value of the given python value. The
+        serializer for the datatype of the field is looked up once (see
+        :func:`formbar.converters.from_python`).
+
+        :value: Python value
+        :returns: Serialized value
+        """
+        if self._serialize is None:
+            self._serialize = get_serializer(self.get_type())
+        return from_python(self, value, self._serialize)
+
     def get_rules(self):
         """Returns a list of configured rules for the field."""
-        return self._config.get_rules()
+        return self._form._prototype.get_rules(self.name)
+
+    def get_validators(self):
+        """Returns a list of configured validators for the field."""
+        return self._form._prototype.get_validators(self.name)
 
     def get_warning_rules(self):
         return [r for r in self.get_rules()
@@ -784,25 +1705,30 @@ class Field(object):
         if expand:
             if not isinstance(value, list):
                 value = [value]
-            ex_values = []
-            options = self.get_options()
-            for opt in options:
-                for v in value:
-                    if hasattr(v, "id"):
-                        v = v.id
-                    if unicode(v) == unicode(opt[1]):
-                        ex_values.append("%s" % opt[0])
-            return ", ".join(ex_values)
+            labels = self._get_option_labels()
+            selected = set(unicode(getattr(v, "id", v)) for v in value)
+            # Keep the order of the options.
+            ex_values = sorted(labels[v] for v in selected if v in labels)
+            return ", ".join("%s" % label for num, label in ex_values)
         else:
             if value:
-                return from_python(self, value)
+                return self.from_python(value)
             elif default:
                 return default
             else:
                 return value
 
-    def _build_filter_rule(self, expr_str, item):
-        t = expr_str.split(" ")
+    def _get_option_labels(self):
+        """Returns a dictionary which maps the values of the options to
+        their position and label. If the renderer of the field renders
+        options its index is used, so the options are only loaded once
+        per rendering."""
+        get_option_labels = getattr(self.renderer, "get_option_labels", None)
+        if get_option_labels is not None:
+            return get_option_labels()
+        return index_options(self.get_options())
+
+    def _get_filter_item_values(self):
         # The filter expression may reference values of the form using $
         # variables. To have access to these values we extract the
         # values from the given item if available.
@@ -813,61 +1739,188 @@ class Field(object):
             item_values.update(self._form.merged_data)
         else:
             item_values = {}
-        for x in t:
-            # % marks the options in the selection field. It is used to
-            # iterate over the options in the selection. I case the
-            # options are SQLAlchemy based options the variable can be
-            # used to access a attribute of the item. E.g. %id will
-            # access the id of the current option item. For user defined
-            # options "%" can be used to iterate over the user defined
-            # options. In this case %attr will access a given attribte
-            # in the option. A bare "%" will give the value of the
-            # option.
-            if x.startswith("%"):
-                key = x.strip("%")
-                value = "*%s" % (key or "value")
-            # @ marks the item of the current fields form item.
-            elif x.startswith("@"):
-                key = x.strip("@")
-                value = getattr(self._form._item, key)
-            # $ special attributes of the current form.
-            elif x.startswith("$"):
-                tmpitem = None
-                value = None
-                tokens = x.split(".")
-                if len(tokens) > 1:
-                    key = tokens[0].strip("$")
-                    attribute = ".".join(tokens[1:])
-                    # FIXME: This is a bad assumption that there is a
-                    # user within a request. (ti) <2014-07-09 11:18>
-                    if key == "user":
-                        tmpitem = self._form._request.user
-                else:
-                    key = tokens[0].strip("$")
-                    value = item_values.get(key) or ''
-                if tmpitem and not value:
-                    value = getattr(tmpitem, attribute)
-                    if hasattr(value, '__call__'):
-                        value = value()
+        return item_values
+
+    def _get_filter_value(self, x, item_values):
+        """Returns the value for the given token of a filter expression
+        or None if the token is not a variable of the form or item.
+        Variables of the options (%) are handled in
+        :class:`.FilterTemplate`."""
+        # @ marks the item of the current fields form item.
+        if x.startswith("@"):
+            key = x.strip("@")
+            value = getattr(self._form._item, key)
+        # $ special attributes of the current form.
+        elif x.startswith("$"):
+            tmpitem = None
+            value = None
+            tokens = x.split(".")
+            if len(tokens) > 1:
+                key = tokens[0].strip("$")
+                attribute = ".".join(tokens[1:])
+                # FIXME: This is a bad assumption that there is a
+                # user within a request. (ti) <2014-07-09 11:18>
+                if key == "user":
+                    tmpitem = self._form._request.user
             else:
-                value = None
+                key = tokens[0].strip("$")
+                value = item_values.get(key) or ''
+            if tmpitem and not value:
+                value = getattr(tmpitem, attribute)
+                if hasattr(value, '__call__'):
+                    value = value()
+        else:
+            value = None
+        return value
+
+    def _get_filter_template(self):
+        """Returns the precompiled :class:`.FilterTemplate` for the
+        filter of the field or None if the field has no filter."""
+        return self._form._prototype.get_filter_template(self.name)
+
+    def _build_filter_clause(self, clazz):
+        """Returns a SQLAlchemy clause for the filter of the field or
+        None if the filter can not be translated into SQL. Only filters
+        which give the same result in the database and in the rule
+        system are translated: Comparisons of a column of the options
+        with a literal or a variable joined by either only "and" or only
+        "or". As "in" has the lowest precedence in rules, it is only
+        supported if the filter is a single comparison. Parentheses and
+        "not" are not supported. Tokens of the filter must be separated
+        by spaces."""
+        tokens = [x for x in self._config.renderer.filter.split(" ") if x]
+        if len(tokens) % 4 != 3:
+            return None
+        connectives = set(tokens[3::4])
+        if len(connectives) > 1 or not connectives <= set(["and", "or"]):
+            return None
+        if connectives and "in" in tokens[1::4]:
+            return None
+        item_values = self._get_filter_item_values()
+        clauses = []
+        try:
+            for pos in range(0, len(tokens), 4):
+                clauses.append(self._get_filter_comparison(tokens[pos],
+                                                           tokens[pos + 1],
+                                                           tokens[pos + 2],
+                                                           clazz,
+                                                           item_values))
+        except FilterTranslationError:
+            return None
+        if "or" in connectives:
+            return sa.or_(*clauses)
+        return sa.and_(*clauses)
+
+    def _get_filter_comparison(self, x, op, y, clazz, item_values):
+        """Returns a SQLAlchemy clause for the comparison of the option
+        attribute x with the value y. Rules compare numbers as floats and
+        other values as strings. So columns of integers and decimals can
+        be compared with numbers and columns of strings can be checked
+        for (in)equality with values which are no numbers. Options
+        without a value (NULL) are compared as the string "None"."""
+        if not x.startswith("%"):
+            raise FilterTranslationError()
+        column = self._get_filter_column(x, clazz)
+        value = self._get_filter_literal(y, item_values)
+        if op == "in":
+            if not isinstance(value, list) or not value:
+                raise FilterTranslationError()
+            values = value
+        elif op in FILTER_OPERATORS and not isinstance(value, list):
+            values = [value]
+        else:
+            raise FilterTranslationError()
+        column_type = column.property.columns[0].type
+        nullable = column.property.columns[0].nullable
+        if (isinstance(column_type, sa.types.Integer)
+                or (isinstance(column_type, sa.types.Numeric)
+                    and not isinstance(column_type, sa.types.Float)
+                    and column_type.asdecimal)):
+            # Numbers are smaller than strings in Python 2, so "None" is
+            # greater than every number.
+            if nullable and op in ("gt", ">", "ge", ">="):
+                raise FilterTranslationError()
+            for v in values:
+                if (not isinstance(v, float) or math.isnan(v)
+                        or math.isinf(v)):
+                    raise FilterTranslationError()
+            values = [int(v) if v == int(v) else v for v in values]
+        elif isinstance(column_type, sa.types.String):
+            if op not in ("eq", "==", "ne", "!=", "in"):
+                raise FilterTranslationError()
+            for v in values:
+                if (not isinstance(v, unicode)
+                        or isinstance(rule_value(v), float)
+                        or (nullable and v == u"None")):
+                    raise FilterTranslationError()
+        else:
+            raise FilterTranslationError()
+        if op == "in":
+            return column.in_(values)
+        clause = FILTER_OPERATORS[op](column, values[0])
+        if nullable and op in ("ne", "!="):
+            clause = sa.or_(clause, column.is_(None))
+        return clause
+
+    def _get_filter_column(self, x, clazz):
+        key = x.strip("%")
+        prop = getattr(clazz, key, None)
+        if (prop is None
+                or not isinstance(getattr(prop, "property", None),
+                                  sa.orm.properties.ColumnProperty)):
+            raise FilterTranslationError()
+        return prop
+
+    def _get_filter_literal(self, x, item_values):
+        """Returns the value of the token x of the filter like it is
+        evaluated by the rule system (see :meth:`.FilterTemplate.bind`)."""
+        if x.startswith("%"):
+            raise FilterTranslationError()
+        value = self._get_filter_value(x, item_values)
+        if value is not None:
+            if isinstance(value, list):
+                return [rule_value(v) for v in value]
+            value = unicode(value)
+            if value.startswith("$"):
+                raise FilterTranslationError()
+            return rule_value(value)
+        if len(x) > 1 and x[0] == x[-1] == "'":
+            return unicode(x[1:-1])
+        if FILTER_NUMBER_RE.match(x):
+            try:
+                return float(x)
+            except ValueError:
+                pass
+        raise FilterTranslationError()
+
+    def _get_selected_values(self):
+        """Returns a list with the values of the options which are
+        selected in the current and previous value of the field."""
+        values = []
+        for value in (self.value, self.previous_value):
+            if not isinstance(value, list):
+                value = [value]
+            for v in value:
+                v = getattr(v, "id", v)
+                if v not in (None, ""):
+                    values.append(v)
+        return values
 
-            if value is not None:
-                if isinstance(value, list):
-                    value = "[%s]" % ",".join("'%s'"
-                                              % unicode(v) for v in value)
-                    expr_str = expr_str.replace(x, value)
-                elif isinstance(value, basestring) and value.startswith("$"):
-                    expr_str = expr_str.replace(x, "%s" % unicode(value))
-                else:
-                    expr_str = expr_str.replace(x, "'%s'" % unicode(value))
-        return Rule(expr_str.replace("*", "$"))
+    def _get_selected_ids(self):
+        """Returns a list with the ids of the current and previous value
+        of the field."""
+        ids = []
+        for v in self._get_selected_values():
+            try:
+                ids.append(int(v))
+            except (TypeError, ValueError):
+                pass
+        return ids
 
-    def _load_options_from_db(self):
+    def _load_options_from_db(self, ids=None):
         # Get mapped clazz for the field
         try:
             clazz = self._get_sa_mapped_class()
-            return self._form._dbsession.query(clazz)
         except:
             # Catch exception here. This exception can happen when
             # rendering the form in the preview of the formeditor. In
@@ -875,7 +1928,128 @@ class Field(object):
             # class.
             log.error("Can not get a mappend class for '%s' "
                       "to load the option from db" % self.name)
-        return []
+            return []
+        cache = self._form._prototype.option_cache
+        label = self._get_option_label()
+        if ids is not None:
+            # Only load the options with the given ids.
+            if not ids:
+                return []
+            return self._snapshot_options(clazz,
+                                          self._get_filter_attributes(),
+                                          label, clazz.id.in_(ids))
+        if cache is None:
+            clause = self._get_option_clause(clazz)
+            if label:
+                return self._snapshot_options(clazz,
+                                              self._get_filter_attributes(),
+                                              label, clause)
+            query = self._form._dbsession.query(clazz)
+            if clause is not None:
+                query = query.filter(clause)
+            return query.order_by(clazz.id)
+        attributes = self._get_filter_attributes()
+        return cache.get((clazz, attributes, label),
+                         lambda: self._snapshot_options(clazz, attributes,
+                                                        label))
+
+    def _get_option_clause(self, clazz):
+        """Returns a SQLAlchemy clause to restrict the options loaded from
+        the database to the options which pass the filter and the
+        currently selected options. The filter is only applied in the
+        database if filtered options are not rendered at all
+        (remove_filtered is "true") and the filter can be translated
+        into SQL. Otherwise None is returned and all options are
+        loaded."""
+        renderer = self._config.renderer
+        if not (renderer and renderer.filter
+                and renderer.remove_filtered == "true"):
+            return None
+        clause = self._build_filter_clause(clazz)
+        if clause is None:
+            log.debug("Filter of '%s' can not be done in the database"
+                      % self.name)
+            return None
+        selected = self._get_selected_ids()
+        if selected:
+            clause = sa.or_(clause, clazz.id.in_(selected))
+        return clause
+
+    def _get_filter_attributes(self):
+        """Returns a tuple with the names of the attributes of the options
+        which are used in the filter of the field."""
+        template = self._get_filter_template()
+        if template is None:
+            return ()
+        return tuple(sorted(template.attributes))
+
+    def _get_option_label(self):
+        """Returns the template for the labels of the options loaded from
+        the database as configured in the option_label attribute of the
+        renderer or None. A plain name of a column is returned as
+        template for this column."""
+        label = self._config.renderer and self._config.renderer.option_label
+        if label and "%" not in label:
+            label = "%" + label
+        return label
+
+    def _snapshot_options(self, clazz, attributes, label=None, clause=None,
+                          offset=None, limit=None):
+        """Returns the options loaded from the database as list of
+        tuples with the label, the id and a dictionary with the given
+        attributes of the item. Unlike the items the tuples can be
+        shared between database sessions.
+
+        If a label template is given only the id and the columns used in
+        the label and the given attributes are queried. The label is
+        build by replacing the %column variables in the template.
+        Otherwise the items are loaded and their string representation
+        is used as label.
+
+        :clazz: Mapped class of the options.
+        :attributes: Tuple of attributes needed to filter the options.
+        :label: Template for the label of the options.
+        :clause: Optional SQLAlchemy clause to restrict the options.
+        :offset: Optional number of options to skip.
+        :limit: Optional maximum number of options.
+        :returns: List of tuples.
+        """
+        db = self._form._dbsession
+        keys = None
+        if label:
+            keys = ["id"]
+            for key in OPTION_LABEL_RE.findall(label) + list(attributes):
+                if key not in keys:
+                    keys.append(key)
+            try:
+                query = db.query(*[self._get_filter_column("%" + key, clazz)
+                                   for key in keys])
+            except FilterTranslationError:
+                log.warning("Can not query the options of '%s' by column. "
+                            "The label or filter uses attributes which are "
+                            "no columns." % self.name)
+                keys = None
+        if keys is None:
+            query = db.query(clazz)
+        if clause is not None:
+            query = query.filter(clause)
+        query = query.order_by(clazz.id)
+        if offset:
+            query = query.offset(offset)
+        if limit is not None:
+            query = query.limit(limit)
+        options = []
+        for item in query:
+            if keys is None:
+                values = dict((key, getattr(item, key)) for key in attributes)
+                options.append((unicode(item), item.id, values))
+            else:
+                row = dict(zip(keys, item))
+                values = dict((key, row[key]) for key in attributes)
+                options.append((OPTION_LABEL_RE.sub(
+                    lambda m: _unicode_or_empty(row[m.group(1)]), label),
+                    row["id"], values))
+        return options
 
     def filter_options(self, options):
         """Will return a of tuples with options. The given options can
@@ -888,10 +2062,13 @@ class Field(object):
 
         """
         filtered_options = []
-        if self._config.renderer and self._config.renderer.filter:
-            rule = self._build_filter_rule(self._config.renderer.filter, None)
-            x = re.compile("\$[\w\.]+")
-            option_values = x.findall(rule._expression)
+        template = self._get_filter_template()
+        if template:
+            item_values = self._get_filter_item_values()
+            params, references = template.bind(
+                lambda x: self._get_filter_value(x, item_values))
+            option_values = template.attributes + references.values()
+            rule = template.rule
         else:
             rule = None
         for option in options:
@@ -904,14 +2081,15 @@ class Field(object):
                 o_value = option.id
                 o_label = option
             if rule:
-                values = {}
+                values = dict(params)
                 for key in option_values:
-                    key = key.strip("$")
                     if isinstance(option, tuple):
                         value = option[2].get(key, "")
                     else:
                         value = getattr(option, key)
                     values[key] = unicode(value)
+                for name, key in references.iteritems():
+                    values[name] = values[key]
                 result = rule.evaluate(values)
                 if result:
                     filtered_options.append((o_label, o_value, True))
@@ -921,7 +2099,7 @@ class Field(object):
                 filtered_options.append((o_label, o_value, True))
         return filtered_options
 
-    def get_options(self):
+    def get_options(self, selected=False):
         """Will return a list of tuples containing the options of the
         field. The tuple contains in the following order:
 
@@ -938,21 +2116,32 @@ class Field(object):
 
         Filtering is currently actually only done for selection based on
         the SQLAlchemy model and which are loaded from the database.
+
+        :selected: If True only the options which are selected in the
+                   current or previous value of the field are returned.
         """
         options = []
         _ = self._form._translate
         if self.get_type() == 'manytoone':
             options.append((_("no selection"), "", True))
         user_defined_options = self._config.options
+        if selected:
+            values = set(unicode(v) for v in self._get_selected_values())
+            is_selected = lambda option: unicode(option[1]) in values
+        else:
+            is_selected = lambda option: True
         if (isinstance(user_defined_options, list)
            and len(user_defined_options) > 0):
             for option in self.filter_options(user_defined_options):
-                options.append((option[0], option[1], option[2]))
+                if is_selected(option):
+                    options.append((option[0], option[1], option[2]))
         elif isinstance(user_defined_options, str):
             for option in self._form.merged_data.get(user_defined_options):
-                options.append((option[0], option[1], True))
+                if is_selected(option):
+                    options.append((option[0], option[1], True))
         elif self._form._dbsession:
-            options.extend(self.filter_options(self._load_options_from_db()))
+            ids = self._get_selected_ids() if selected else None
+            options.extend(self.filter_options(self._load_options_from_db(ids)))
         else:
             # TODO: Try to get the session from the item. Ther must be
             # somewhere the already bound session. (torsten) <2013-07-23 00:27>
@@ -961,6 +2150,65 @@ class Field(object):
             return []
         return options
 
+    def search_options(self, term=u"", page=0, pagesize=OPTION_PAGESIZE):
+        """Returns a page of the visible options of the field whose label
+        starts with the given term (case insensitive). If the options
+        come from the database and the label of the options is a single
+        column (See option_label of the renderer), the search and paging
+        is done in the database. Otherwise all options are loaded and
+        searched.
+
+        :term: Search term.
+        :page: Number of the page starting with 0.
+        :pagesize: Number of options per page.
+        :returns: Dictionary with the list of "options" (each with "id"
+                  and "label"), the "page" and a flag "more" which is
+                  True if there are further pages.
+        """
+        _ = self._form._translate
+        term = term.lower()
+        start = page * pagesize
+        options = self._search_options_in_db(term, start, pagesize + 1)
+        if options is None:
+            options = [option for option in self.get_options()
+                       if option[2] and option[1] != ""
+                       and _(unicode(option[0])).lower().startswith(term)]
+            options = options[start:start + pagesize + 1]
+        return {"options": [{"id": option[1], "label": _(unicode(option[0]))}
+                            for option in options[:pagesize]],
+                "page": page,
+                "more": len(options) > pagesize}
+
+    def _search_options_in_db(self, term, offset, limit):
+        """Returns the visible options whose label starts with the given
+        term loaded with the given offset and limit from the database or
+        None if the search can not be done in the database."""
+        label = self._get_option_label()
+        if (self._config.options or not self._form._dbsession
+                or not label or not re.match(r"^%\w+$", label)):
+            return None
+        try:
+            clazz = self._get_sa_mapped_class()
+        except (AttributeError, sa.orm.exc.UnmappedInstanceError):
+            # The field is no relation of a mapped item.
+            return None
+        try:
+            column = self._get_filter_column(label, clazz)
+        except FilterTranslationError:
+            return None
+        escaped = (term.replace("\\", "\\\\").replace("%", "\\%")
+                   .replace("_", "\\_"))
+        clause = column.ilike(escaped + "%", escape="\\")
+        if self._config.renderer.filter:
+            filter_clause = self._build_filter_clause(clazz)
+            if filter_clause is None:
+                return None
+            clause = sa.and_(filter_clause, clause)
+        options = self._snapshot_options(clazz, self._get_filter_attributes(),
+                                         label, clause, offset, limit)
+        return [option for option in self.filter_options(options)
+                if option[2]]
+
     def add_error(self, error):
         self._errors.append(error)
 
@@ -1,4 +1,5 @@
 import os
+import itertools
 from dateutil import tz
 from formbar import static_dir
 
@@ -46,6 +47,40 @@ def get_js():
     return "".join(out)
 
 
+UTC = tz.tzutc()
+"""Timezone object for UTC."""
+
+_timezones = {}
+"""Dictionary with the timezone objects which has been resolved by their
+name. The local timezone of the server is stored under None."""
+
+
+def get_timezone(timezone=None):
+    """Returns the timezone object for the given timezone. The timezone
+    objects are only created once and cached afterwards. Timezones which
+    are equal to UTC are returned as :data:`UTC`.
+
+    :timezone: String timezone (eg. Europe/Berlin), timezone object or
+               None for the local timezone of the server.
+    :returns: timezone object
+
+    """
+    if timezone is not None and not isinstance(timezone, basestring):
+        return timezone
+    tzinfo = _timezones.get(timezone)
+    if tzinfo is None:
+        if timezone is None:
+            tzinfo = tz.tzlocal()
+        else:
+            tzinfo = tz.gettz(timezone)
+            if tzinfo is None:
+                raise ValueError('Unknown timezone "%s"' % timezone)
+        if tzinfo == UTC or timezone in ("UTC", "Etc/UTC"):
+            tzinfo = UTC
+        _timezones[timezone] = tzinfo
+    return tzinfo
+
+
 def get_local_datetime(dt, timezone=None):
     """Will return a datetime converted into to given timezone. If the
     given datetime is naiv and does not support timezone information
@@ -53,29 +88,50 @@ def get_local_datetime(dt, timezone=None):
     timezone of the server will be used.
 
     :dt: datetime
-    :timezone: String timezone (eg. Europe/Berin)
+    :timezone: String timezone (eg. Europe/Berin) or timezone object
     :returns: datetime
 
     """
+    timezone = get_timezone(timezone)
     if not dt.tzinfo:
-        dt = dt.replace(tzinfo=tz.gettz('UTC'))
-    if not timezone:
-        timezone = tz.tzlocal()
+        if timezone is UTC:
+            return dt.replace(tzinfo=UTC)
+        dt = dt.replace(tzinfo=UTC)
     return dt.astimezone(timezone)
 
 
 def get_utc_datetime(dt, timezone=None):
-    """Will return a datetime converted into to given timezone. If the
+    """Will return the given datetime converted into UTC. If the
     given datetime is naiv and does not support timezone information
-    then UTC timezone is assumed. If timezone is None, then the local
-    timezone of the server will be used.
+    then it is assumed to be in the given timezone. If timezone is
+    None, then the local timezone of the server will be used.
 
     :dt: datetime
-    :timezone: String timezone (eg. Europe/Berin)
+    :timezone: String timezone (eg. Europe/Berin) or timezone object
     :returns: datetime
 
     """
-    if not timezone:
-        dt = dt.replace(tzinfo=tz.tzlocal())
-    timezone = tz.gettz('UTC')
-    return dt.astimezone(timezone)
+    if not dt.tzinfo:
+        timezone = get_timezone(timezone)
+        if timezone is UTC:
+            return dt.replace(tzinfo=UTC)
+        dt = dt.replace(tzinfo=timezone)
+    return dt.astimezone(UTC)
+
+
+def get_chunks(iterable, size):
+    """Will split the given iterable into lists with up to `size`
+    elements. The iterable is consumed lazy, so only one chunk is held
+    in memory at a time.
+
+    :iterable: Iterable
+    :size: Maximum number of elements in a chunk
+    :returns: yields lists
+
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
@@ -0,0 +1,121 @@
+"""Validation of large amounts of records using multiple processes.
+Validation is CPU bound as conversion and rule evaluation is done in
+pure python. The :class:`.ValidationPool` distributes the records in
+chunks to a pool of worker processes. Each worker builds the form once
+on startup and validates all the chunks it gets with this form."""
+
+import collections
+import multiprocessing
+import xml.etree.ElementTree as ET
+from formbar.config import Config
+from formbar.form import Form, ValidationResult
+from formbar.helpers import get_chunks
+
+_form = None
+"""Form used for validation in the worker process."""
+
+
+def _init_worker(xml, form_id, locale, translate, timezone):
+    """Initializes the form for the worker process. Called once per
+    worker on startup of the pool."""
+    global _form
+    config = Config(ET.fromstring(xml))
+    _form = Form(config.get_form(form_id), translate=translate,
+                 locale=locale, timezone=timezone)
+
+
+def _validate_chunk(records):
+    """Validates the given records in the worker process. Returns a list
+    with a tuple of the converted data, errors and warnings per record."""
+    return [(r.data, r.errors, r.warnings)
+            for r in _form.validate_many(records)]
+
+
+class ValidationPool(object):
+    """Pool of worker processes to validate records against a form
+    configuration. The form configuration is sent to each worker only
+    once on startup of the pool. The records are sent to the workers in
+    chunks. Note that the validation is done without an item, database
+    session or external validators. Only rules and validators defined
+    in the form configuration are checked.
+
+    The pool should be closed after usage. It can be used as a context
+    manager::
+
+        with ValidationPool(form_config, processes=4) as pool:
+            for result in pool.validate_many(records):
+                ...
+    """
+
+    def __init__(self, config, processes=None, locale=None, chunksize=500,
+                 translate=None, timezone=None):
+        """Initialize the pool and start the worker processes.
+
+        :config: FormConfiguration.
+        :processes: Number of worker processes. Defaults to the number
+                    of CPUs.
+        :locale: String of the locale of the form.
+        :chunksize: Default number of records sent to a worker at once.
+        :translate: Translation function for the messages of the
+                    results. Must be picklable (e.g a module level
+                    function) on platforms which do not fork the
+                    workers.
+        :timezone: Name of the timezone of submitted datetimes (eg.
+                   "Europe/Berlin"). Defaults to the local timezone of
+                   the server.
+        """
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self.processes = processes
+        self.chunksize = chunksize
+        self._pool = multiprocessing.Pool(processes, _init_worker,
+                                          (config.to_xml(), config.id,
+                                           locale, translate, timezone))
+
+    def validate_many(self, records, chunksize=None):
+        """Generator which validates all records of the given iterable
+        and yields a :class:`.ValidationResult` per record in the order
+        of the records. The records are consumed lazy and only a limited
+        number of chunks is processed at the same time, so the memory
+        usage does not depend on the number of records.
+
+        :records: Iterable with dictionaries of submitted values.
+        :chunksize: Number of records sent to a worker at once. Defaults
+                    to the chunksize of the pool.
+        :returns: yields :class:`.ValidationResult`
+
+        """
+        pending = collections.deque()
+        for chunk in get_chunks(records, chunksize or self.chunksize):
+            pending.append(self._pool.apply_async(_validate_chunk, (chunk,)))
+            # Keep every worker busy but do not queue up all records.
+            if len(pending) > self.processes * 2:
+                for result in self._get_results(pending.popleft()):
+                    yield result
+        while pending:
+            for result in self._get_results(pending.popleft()):
+                yield result
+
+    def _get_results(self, async_result):
+        for data, errors, warnings in async_result.get():
+            yield ValidationResult(data, errors, warnings)
+
+    def close(self):
+        """Will stop the worker processes after all pending work has
+        been done."""
+        self._pool.close()
+        self._pool.join()
+
+    def terminate(self):
+        """Will stop the worker processes immediately."""
+        self._pool.terminate()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
@@ -4,6 +4,7 @@ import xml.etree.ElementTree as ET
 from webhelpers.html import literal, HTML
 
 from mako.lookup import TemplateLookup
+from mako.filters import html_escape
 from formbar import template_dir
 from formbar.rules import Rule
 
@@ -65,7 +66,7 @@ def get_renderer(field, translate):
             return SelectionFieldRenderer(field, translate)
         elif dtype == "date":
             return DateFieldRenderer(field, translate)
-        elif dtype == "file":
+        elif dtype in ("file", "upload"):
             return FileFieldRenderer(field, translate)
         elif dtype == "time":
             return TimeFieldRenderer(field, translate)
@@ -76,6 +77,22 @@ def get_renderer(field, translate):
     return TextFieldRenderer(field, translate)
 
 
+def index_options(options):
+    """Returns a dictionary which maps the unicode value of the given
+    options to a tuple with the position and the label of the option.
+    The index is used to look up the labels of selected values without
+    comparing each value against all options.
+
+    :options: List of options as returned by :meth:`.Field.get_options`
+    :returns: Dictionary
+
+    """
+    index = {}
+    for num, option in enumerate(options):
+        index.setdefault(unicode(option[1]), (num, option[0]))
+    return index
+
+
 class Renderer(object):
     """Basic renderer to render Form objects."""
 
@@ -92,19 +109,26 @@ class FormRenderer(Renderer):
     """Renderer for forms. The renderer will build the the HTML for the
     provided form instance."""
 
-    def __init__(self, form, translate):
+    def __init__(self, form, translate, compiled=True):
         """@todo: to be defined
 
         :form: @todo
         :translate: Function which return a translated string for a
         given msgid.
+        :compiled: Flag to indicate that the layout of the form is
+        rendered with the compiled :class:`RenderPlan` of the form
+        configuration. If False the ``form.mako`` template is used.
+        Defaults to True.
 
         """
         Renderer.__init__(self)
 
         self._form = form
         self.translate = translate
-        self.template = template_lookup.get_template("form.mako")
+        self.compiled = compiled
+        self.template = None
+        if not compiled:
+            self.template = template_lookup.get_template("form.mako")
 
     def render(self, buttons=True, outline=True):
         """Returns the rendered form as string.
@@ -135,7 +159,8 @@ class FormRenderer(Renderer):
                              method=self._form._config.method,
                              autocomplete=self._form._config.autocomplete,
                              enctype=self._form._config.enctype,
-                             evalurl=self._form._eval_url or ""))
+                             evalurl=self._form._eval_url or "",
+                             searchurl=self._form._search_url))
         # Add hidden field with csrf_token if this is not None.
         if self._form._csrf_token:
             html.append(HTML.tag("input",
@@ -145,6 +170,9 @@ class FormRenderer(Renderer):
         return literal("").join(html)
 
     def _render_form_body(self, render_outline):
+        if self.compiled:
+            plan = get_render_plan(self._form._config, render_outline)
+            return plan.render(self._form, self.translate)
         values = {'form': self._form,
                   '_': self.translate,
                   'render_outline': render_outline,
@@ -156,7 +184,7 @@ class FormRenderer(Renderer):
         _ = self.translate
         html = []
         html.append(HTML.tag("div", _closed=False, class_="row row-fluid"))
-        if len(self._form._config.get_pages()) > 0:
+        if len(self._form.pages) > 0:
             html.append(HTML.tag("div",
                                  class_="col-sm-3 span3 button-pane"))
             html.append(HTML.tag("div", _closed=False,
@@ -204,6 +232,403 @@ class FormRenderer(Renderer):
         return literal("").join(html)
 
 
+def _escape(value):
+    """Returns the escaped unicode string of the given value like the
+    default filter of the templates does."""
+    return unicode(html_escape(value))
+
+
+def _cell_attributes(element):
+    return u'colspan="%s" class="%s" rowspan="%s" width="%s"' % tuple(
+        _escape(element.attrib.get(name, ''))
+        for name in ('colspan', 'class', 'rowspan', 'width'))
+
+
+def _append(program, *ops):
+    """Appends the given ops to the program. Consecutive static HTML
+    segments are joined into one segment."""
+    for op in ops:
+        if (isinstance(op, basestring) and program
+                and isinstance(program[-1], basestring)):
+            program[-1] += op
+        else:
+            program.append(op)
+
+
+def _run(program, form, _, out, mode, active):
+    """Runs the given program of a :class:`RenderPlan` and appends the
+    rendered HTML to out."""
+    for op in program:
+        if isinstance(op, basestring):
+            out.append(op)
+        else:
+            op.render(form, _, out, mode, active)
+
+
+class _Text(object):
+    """Slot for a translated text."""
+
+    def __init__(self, msgid):
+        self.msgid = msgid
+
+    def render(self, form, _, out, mode, active):
+        out.append(_escape(_(self.msgid)))
+
+
+class _Messages(object):
+    """Slot for the form wide warnings and errors."""
+
+    def render(self, form, _, out, mode, active):
+        for warn in form.warnings:
+            out.append(u'<div class="alert alert-warning" role="warning">'
+                       u'<i class="glyphicon glyphicon-exclamation-sign"></i>'
+                       u' %s</div>\n' % _escape(warn))
+        for err in form.errors:
+            out.append(u'<div class="alert alert-danger" role="alert">'
+                       u'<i class="glyphicon glyphicon-exclamation-sign"></i>'
+                       u' %s</div>\n' % _escape(err))
+
+
+class _Field(object):
+    """Slot for a field."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def render(self, form, _, out, mode, active):
+        field = form.get_field(self.name)
+        if mode == "readonly":
+            field.readonly = True
+        out.append(unicode(field.render(active)))
+
+
+class _Page(object):
+    """Block of a page. The block is skipped if the form is scoped to a
+    different page."""
+
+    def __init__(self, page, program):
+        self.page = page
+        self.program = program
+
+    def render(self, form, _, out, mode, active):
+        if form.renders_page(self.page):
+            _run(self.program, form, _, out, mode, active)
+
+
+class _PageStart(object):
+    """Start of a page in a form with outline."""
+
+    def __init__(self, num, page):
+        self.num = num
+        self.number = int(page.attrib.get('id').strip("p"))
+
+    def render(self, form, _, out, mode, active):
+        out.append(u'<div class="formbar-page %s" id="formbar-page-%s">\n'
+                   % (_escape(self.number == form.current_page
+                              and 'active'), self.num + 1))
+
+
+class _Snippet(object):
+    """Block of a referenced snippet. Like in the template snippets are
+    rendered without the mode of the surrounding conditionals."""
+
+    def __init__(self, program):
+        self.program = program
+
+    def render(self, form, _, out, mode, active):
+        _run(self.program, form, _, out, '', active)
+
+
+class _Conditional(object):
+    """Block of a conditional which is evaluated on the client. The
+    rule is evaluated on rendering to set the initial state."""
+
+    def __init__(self, element, program):
+        self.rule = Rule(element.attrib.get("expr"))
+        self.readonly = element.attrib.get('type') == 'readonly'
+        self.program = program
+        self.start = u'<div id="%s" class="formbar-conditional %s ' % (
+            id(element), _escape(element.attrib.get('type')))
+        self.end = u'" reset-value="%s" expr="%s"' % (
+            _escape(element.attrib.get('reset-value', 'false')),
+            _escape(element.attrib.get('expr')))
+
+    def render(self, form, _, out, mode, active):
+        is_active = self.rule.evaluate(form.merged_data)
+        out.append(self.start)
+        out.append(is_active and u"active" or u"inactive")
+        out.append(self.end)
+        if self.readonly:
+            out.append(u'>\n')
+        elif is_active:
+            out.append(u' style="">\n')
+        else:
+            out.append(u' style="display:none">\n')
+        _run(self.program, form, _, out, mode, is_active)
+        out.append(u'</div>\n')
+
+
+class _StaticConditional(object):
+    """Block of a static conditional which is evaluated on rendering.
+    If the rule fails the block is rendered in the mode given by the
+    type of the conditional (e.g readonly) or is hidden."""
+
+    def __init__(self, element, program, mode=None):
+        self.rule = Rule(element.attrib.get("expr"))
+        self.mode = mode or element.attrib.get('type', 'hide')
+        self.program = program
+
+    def render(self, form, _, out, mode, active):
+        if self.rule.evaluate(form.merged_data):
+            _run(self.program, form, _, out, mode, active)
+        elif self.mode != 'hide':
+            _run(self.program, form, _, out, self.mode, active)
+
+
+class _OutlineEntry(object):
+    """Entry of a page in the outline."""
+
+    def __init__(self, page):
+        self.page = page
+        self.number = int(page.attrib.get('id').strip("p"))
+        self.href = _escape(page.attrib.get('id'))
+        self.label = page.attrib.get('label')
+
+    def render(self, form, _, out, mode, active):
+        out.append(u'<a href="#%s" class="list-group-item %s" '
+                   u'formbar-lastpage="%s" formbar-baseurl="%s" '
+                   u'formbar-item="%s" formbar-itemid="%s">%s\n' % (
+                       self.href,
+                       _escape(self.number == form.current_page
+                               and 'selected'),
+                       _escape(str(form.last_page == self.number).lower()),
+                       _escape(form._url_prefix),
+                       _escape(form.change_page_callback.get('item')),
+                       _escape(form.change_page_callback.get('itemid')),
+                       _escape(_(self.label))))
+        out.append(u'<span class="label label-danger pull-right">%s</span>\n'
+                   % _escape(len(form.get_errors(self.page)) or ""))
+        out.append(u'<span class="label label-warning pull-right">%s</span>\n'
+                   % _escape(len(form.get_warnings(self.page)) or ""))
+        out.append(u'</a>\n')
+
+
+class RenderPlan(object):
+    """Compiled layout of a form configuration. The ``form.mako``
+    template walks the XML tree of the form on every rendering. The
+    plan walks the tree only once and compiles it into a flat program
+    of static HTML segments, slots for fields and translated texts and
+    blocks for pages and conditionals. On rendering only the slots and
+    blocks are evaluated. The rendered HTML is the same as the one of
+    the template apart from whitespace.
+
+    Plans are cached per form configuration. See
+    :func:`get_render_plan`.
+    """
+
+    def __init__(self, config, outline=True):
+        """Compiles the plan for the given form configuration.
+
+        :config: Form configuration
+        :outline: Flag to indicate that the outline for pages is
+                  rendered.
+        """
+        self._config = config
+        self._outline = outline
+        self.program = []
+        """List of static HTML segments, slots and blocks."""
+        pages = config.get_pages()
+        if outline and len(pages) > 0:
+            self._compile_with_outline(pages, self.program)
+        else:
+            self._compile_without_outline(self.program)
+
+    def render(self, form, translate):
+        """Returns the rendered layout of the given form.
+
+        :form: :class:`.Form` instance
+        :translate: Translation function
+        :returns: Rendered HTML
+        """
+        out = []
+        _run(self.program, form, translate, out, '', True)
+        return literal(u"".join(out))
+
+    def _compile_with_outline(self, pages, program):
+        _append(program, u'<div class="row">\n'
+                u'<div class="col-sm-3 hidden-print">\n<div>\n'
+                u'<div class="panel panel-default formbar-outline">\n'
+                u'<!-- Default panel contents -->\n'
+                u'<div class="panel-heading">', _Text('Outline'),
+                u'</div>\n<!-- List group -->\n<ul class="list-group">\n')
+        self._compile_outline(self._config._tree, program)
+        _append(program, u'</ul>\n</div>\n</div>\n</div>\n'
+                u'<div class="col-sm-9">\n')
+        for num, page in enumerate(pages):
+            body = []
+            self._compile(page, body)
+            _append(program, _PageStart(num, page), u'<h1 class="page">',
+                    _Text(page.attrib.get('label')), u'</h1>\n',
+                    _Messages(), _Page(page, body), u'</div>\n')
+        _append(program, u'</div>\n</div>\n')
+
+    def _compile_without_outline(self, program):
+        _append(program, u'<div class="row">\n<div class="col-sm-12">\n',
+                _Messages())
+        self._compile(self._config._tree, program)
+        _append(program, u'</div>\n</div>\n')
+
+    def _compile_outline(self, element, program):
+        for child in element:
+            if child.tag == "snippet":
+                ref = child.attrib.get('ref')
+                if ref:
+                    child = self._config._parent.get_element('snippet', ref)
+            elif child.tag == "page":
+                _append(program, _OutlineEntry(child))
+            static = child.attrib.get("static") == "true"
+            conditional = (child.tag == "if" and not static
+                           and len(child) > 0 and child[0].tag == "page")
+            if conditional:
+                _append(program, u'<div id="%s" class="formbar-conditional '
+                        u'%s" reset-value="%s" expr="%s">\n' % (
+                            id(child), _escape(child.attrib.get('type')),
+                            _escape(child.attrib.get('reset-value',
+                                                     'false')),
+                            _escape(child.attrib.get('expr'))))
+            if static:
+                body = []
+                self._compile_outline(child, body)
+                # Failing static conditionals hide their pages in the
+                # outline regardless of their type.
+                _append(program, _StaticConditional(child, body, 'hide'))
+            else:
+                self._compile_outline(child, program)
+            if conditional:
+                _append(program, u'</div>\n')
+
+    def _compile(self, elem, program):
+        """Compiles the children of the given element into the
+        program."""
+        for child in elem:
+            if child.tag == "page":
+                body = []
+                self._compile_element(child, elem, body)
+                _append(program, _Page(child, body))
+            else:
+                self._compile_element(child, elem, program)
+
+    def _compile_element(self, child, elem, program):
+        if len(child) == 0:
+            self._compile_leaf(child, program)
+            return
+        self._compile_start(child, elem, program)
+        static = child.attrib.get("static") == "true"
+        if child.tag == "if" and not static:
+            body = []
+            self._compile(child, body)
+            _append(program, _Conditional(child, body))
+        elif static:
+            body = []
+            self._compile(child, body)
+            _append(program, _StaticConditional(child, body))
+        else:
+            self._compile(child, program)
+        self._compile_end(child, program)
+
+    def _compile_start(self, child, elem, program):
+        tag = child.tag
+        if tag == "page" and not self._outline:
+            _append(program, u'<h1 class="page">',
+                    _Text(child.attrib.get("label")), u'</h1>\n')
+        elif tag in ("section", "subsection", "subsubsection"):
+            level = {"section": 2, "subsection": 3, "subsubsection": 4}[tag]
+            _append(program, u'<h%s class="section">' % level,
+                    _Text(child.attrib.get('label')), u'</h%s>\n' % level)
+        elif tag == "row":
+            _append(program, u'<div class="row row-fluid">\n')
+        elif tag == "col":
+            width = _escape(child.attrib.get('width', (12 / len(elem))))
+            _append(program, u'<div class="col-md-%s span%s">\n'
+                    % (width, width))
+        elif tag == "fieldset":
+            _append(program, u'<fieldset>\n<legend>',
+                    _Text(child.attrib.get('label')), u'</legend>\n')
+        elif tag == "table":
+            _append(program, u'<table class="table table-condensed '
+                    u'table-bordered table-striped">\n')
+        elif tag == "tr":
+            _append(program, u'<tr class="%s">\n'
+                    % _escape(child.attrib.get('class', '')))
+        elif tag in ("th", "td"):
+            _append(program, u'<%s %s>\n' % (tag, _cell_attributes(child)))
+        elif tag == "html":
+            _append(program, unicode(ET.tostring(child)) + u'\n')
+
+    def _compile_end(self, child, program):
+        tag = child.tag
+        if tag == "fieldset":
+            _append(program, u'</fieldset>\n')
+        elif tag in ("col", "row"):
+            _append(program, u'</div>\n')
+        elif tag in ("table", "tr", "th", "td"):
+            _append(program, u'</%s>\n' % tag)
+
+    def _compile_leaf(self, child, program):
+        tag = child.tag
+        if tag == "field":
+            name = self._config._id2name[child.attrib.get('ref')]
+            _append(program, _Field(name), u'\n')
+        elif tag == "snippet":
+            ref = child.attrib.get('ref')
+            if ref:
+                body = []
+                snippet = self._config._parent.get_element('snippet', ref)
+                self._compile(snippet, body)
+                _append(program, _Snippet(body))
+        elif tag == "text":
+            textclasses = []
+            if child.attrib.get('bg'):
+                textclasses.append("bg-%s" % child.attrib.get('bg'))
+                textclasses.append("text-generic")
+            if child.attrib.get('color'):
+                textclasses.append("text-%s" % child.attrib.get('color'))
+            ems = []
+            if child.attrib.get('em'):
+                ems = child.attrib.get('em').split(" ")
+            _append(program, u'<p class="%s">\n'
+                    % _escape(' '.join(textclasses)))
+            for em in ems:
+                _append(program, u'<%s>\n' % _escape(em))
+            _append(program, _Text(child.text), u'\n')
+            for em in ems:
+                _append(program, u'</%s>\n' % _escape(em))
+            _append(program, u'</p>\n')
+        elif tag == "th":
+            _append(program, u'<th %s>%s</th>\n' % (_cell_attributes(child),
+                                                     _escape(child.text)))
+        elif tag == "td":
+            _append(program, u'<td %s>%s</td>\n' % (
+                _cell_attributes(child), _escape(child.text or "")))
+
+
+def get_render_plan(config, outline=True):
+    """Returns the :class:`RenderPlan` for the given form configuration.
+    The plan is compiled on the first call and cached in the
+    configuration afterwards.
+
+    :config: Form configuration
+    :outline: Flag to indicate that the outline for pages is rendered.
+    :returns: :class:`RenderPlan`
+    """
+    outline = bool(outline)
+    plan = config._render_plans.get(outline)
+    if plan is None:
+        plan = RenderPlan(config, outline)
+        config._render_plans[outline] = plan
+    return plan
+
+
 class FieldRenderer(Renderer):
     """Renderer for fields. The renderer will build the the HTML for the
     provided field."""
@@ -467,13 +892,28 @@ class OptionFieldRenderer(FieldRenderer):
     def __init__(self, field, translate):
         FieldRenderer.__init__(self, field, translate)
         self._cache_options = None
+        self._cache_labels = None
+
+    def _get_options(self):
+        if self._cache_options is None:
+            # In search mode only the selected options are rendered. All
+            # other options are fetched by the client on demand.
+            self._cache_options = self._field.get_options(
+                selected=(self.search == "true"))
+        return self._cache_options
+
+    def get_option_labels(self):
+        """Returns the index of the rendered options. See
+        :func:`index_options`. The index is built only once per renderer
+        and shared by all lookups of labels while rendering the field."""
+        if self._cache_labels is None:
+            self._cache_labels = index_options(self._get_options())
+        return self._cache_labels
 
     def _get_template_values(self):
         values = FieldRenderer._get_template_values(self)
         # Add the options to the values dictionary
-        if self._cache_options is None:
-            self._cache_options = self._field.get_options()
-        values['options'] = self._cache_options
+        values['options'] = self._get_options()
         return values
 
 
@@ -61,3 +61,74 @@ class Rule(Expression):
         if values is None:
             values = {}
         return bool(self._evaluate(self._expression_tree, values))
+
+
+class FilterTemplate(object):
+    """Precompiled filter expression for the options of a field. The
+    expression is parsed only once. Tokens referencing attributes of the
+    options (``%attr``) become variables of the rule and tokens
+    referencing values of the form (``$field``) or the item
+    (``@attr``) become parameters which are bound to their values before
+    the options are filtered. The tokens of the expression must be
+    separated by spaces."""
+
+    def __init__(self, expression):
+        """Initialize the template.
+
+        :expression: String of the filter expression.
+        """
+        self.expression = expression
+        self.attributes = []
+        """List with the names of the option attributes used in the
+        expression."""
+        self.params = []
+        """List of tuples with the name of the parameter and the token
+        in the expression."""
+        tokens = []
+        for x in expression.split(" "):
+            if x.startswith("%"):
+                # A bare "%" will give the value of the option.
+                key = x.strip("%") or "value"
+                if key not in self.attributes:
+                    self.attributes.append(key)
+                tokens.append("$%s" % key)
+            elif x.startswith("@") or x.startswith("$"):
+                name = "_p%s" % len(self.params)
+                self.params.append((name, x))
+                tokens.append("$%s" % name)
+            else:
+                tokens.append(x)
+        self.rule = Rule(" ".join(tokens))
+
+    def bind(self, resolve):
+        """Returns a tuple of a dictionary with the values of the
+        parameters and a dictionary with parameters which reference an
+        attribute of the options. The values are resolved by calling
+        the given function with the token of the parameter.
+
+        :resolve: Function which returns the value for a token.
+        :returns: Tuple of dictionaries.
+        """
+        params = {}
+        references = {}
+        for name, token in self.params:
+            value = resolve(token)
+            if isinstance(value, list):
+                value = [rule_value(v) for v in value]
+            elif isinstance(value, basestring) and value.startswith("$"):
+                references[name] = value.strip("$")
+                continue
+            elif value is not None:
+                value = unicode(value)
+            params[name] = value
+        return params, references
+
+
+def rule_value(value):
+    """Returns the given value like it is evaluated by the rule system.
+    Numbers become floats, other values unicode strings. This matches
+    the coercion of variables in brabbel before 0.4."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return unicode(value)
@@ -744,6 +744,96 @@ var form = function (inputFilter, ruleEngine) {
 } (inputFilter, ruleEngine);
 
 
+/**
+ * @module
+ *
+ * Searching options of dropdown and selection fields in search mode. In
+ * search mode the server only renders the selected options. Further options
+ * are fetched page by page from the "searchurl" of the form while the user
+ * types in the search field.
+ *
+ * @public
+ * @function
+ *
+ * init - initialization of the search fields
+ */
+var optionSearch = function () {
+    var timeout = null;
+
+    /**
+     * @function
+     *
+     * fetches the given page of options matching the value of the search
+     * field and adds them to the select element.
+     *
+     * @param {Object} input - the search field as jQuery object
+     *
+     * @param {number} page - number of the page starting with 0
+     */
+    var search = function (input, page) {
+        var id = input.attr("formbar-search");
+        var select = $("#" + id);
+        var more = $(".formbar-option-more[formbar-search='" + id + "']");
+        var url = input.closest("form").attr("searchurl");
+        var term = input.val();
+        $.ajax({
+            type: "GET",
+            url: url,
+            data: {
+                field: select.attr("name"),
+                term: term,
+                page: page
+            },
+            success: function (data) {
+                if (term !== input.val()) {
+                    // Ignore responses for outdated search terms which
+                    // arrive after the response for the current term.
+                    return;
+                }
+                if (data.page === 0) {
+                    // Keep selected options and the empty option.
+                    select.find("option").not(":selected").not("[value='']").remove();
+                }
+                data.options.forEach(function (option) {
+                    if (select.find("option[value='" + option.id + "']").length === 0) {
+                        select.append($("<option>").val(option.id).text(option.label));
+                    }
+                });
+                more.attr("formbar-page", data.page + 1);
+                more.toggleClass("hidden", !data.more);
+            },
+            error: function (data) {
+                console.log("Request to search server fails!");
+            }
+        });
+    };
+
+    var onInput = function (e) {
+        var input = $(e.target);
+        clearTimeout(timeout);
+        timeout = setTimeout(function () {
+            search(input, 0);
+        }, 300);
+    };
+
+    var onMore = function (e) {
+        e.preventDefault();
+        var id = $(e.target).attr("formbar-search");
+        var input = $(".formbar-option-search[formbar-search='" + id + "']");
+        search(input, parseInt($(e.target).attr("formbar-page"), 10));
+    };
+
+    var init = function () {
+        $(".formbar-option-search").on("input", onInput);
+        $(".formbar-option-more").on("click", onMore);
+    };
+
+    return {
+        init: init
+    };
+} ();
+
+
 /**
  * @module 
  * formbar
@@ -921,6 +1011,7 @@ var formbar = function (form) {
         $('div.formbar-form form').not(".disable-double-submit-prevention").preventDoubleSubmission();
         initDatePicker();
         initSubmit();
+        optionSearch.init();
         form.init();
     };
 
@@ -4,6 +4,9 @@ readonly = (field.is_readonly() and "disabled") or ""
 ## handle the special case here if there is no value set. (ti) <2015-07-07
 ## 14:50> 
 selected = field.get_value() or []
+if not isinstance(selected, list):
+  selected = [selected]
+selected = set(selected)
 %>
 % for num, option in enumerate(options):
   ## Depending if the options has passed the configured filter the
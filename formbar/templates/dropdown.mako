@@ -7,19 +7,26 @@
     % endif
   </div>
 % else:
+  % if field.renderer.search == "true":
+    <input type="text" class="form-control formbar-option-search" formbar-search="${field.id}" placeholder="${_('Search')}" autocomplete="off"/>
+  % endif
   <select class="form-control" id="${field.id}" name="${field.name}">
+    <% selected = unicode(field.get_value()) %>
     % for option in options:
       ## Depending if the options has passed the configured filter the
       ## option will be visible or hidden
       % if option[2]:
-        % if str(option[1]) == str(field.get_value()):
+        % if unicode(option[1]) == selected:
           <option value="${option[1]}" selected="selected">${_(option[0])}</option>
         % else:
           <option value="${option[1]}">${_(option[0])}</option>
         % endif
-      % elif unicode(option[1]) == unicode(field.get_value()) and not field.renderer.remove_filtered == "true":
+      % elif unicode(option[1]) == selected and not field.renderer.remove_filtered == "true":
         <option value="${option[1]}" class="hidden">${_(option[0])}</option>
       % endif
     % endfor
   </select>
+  % if field.renderer.search == "true":
+    <a href="#" class="formbar-option-more hidden" formbar-search="${field.id}">${_('More')}</a>
+  % endif
 % endif
@@ -21,7 +21,7 @@
   </div>
   <div class="col-sm-9">
   % for num, page in enumerate(form.pages):
-    <div class="formbar-page ${num==form.current_page-1 and 'active'}" id="formbar-page-${num+1}">
+    <div class="formbar-page ${int(page.attrib.get('id').strip("p"))==form.current_page and 'active'}" id="formbar-page-${num+1}">
       <h1 class="page">${_(page.attrib.get('label'))}</h1>
       ## Render errors and warnings
       % for warn in form.warnings:
@@ -30,7 +30,9 @@
       % for err in form.errors:
         <div class="alert alert-danger" role="alert"><i class="glyphicon glyphicon-exclamation-sign"></i> ${err}</div>
       % endfor
-      ${self.render_recursive(page)}
+      % if form.renders_page(page):
+        ${self.render_recursive(page)}
+      % endif
     </div>
   % endfor
   </div>
@@ -81,6 +83,8 @@
     <%
       if mode == 'hide':
         continue
+      if child.tag == "page" and not form.renders_page(child):
+        continue
       is_active = active
     %>
     % if len(child) > 0:
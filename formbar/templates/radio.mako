@@ -5,7 +5,7 @@ if isinstance(selected, list):
   raise TypeError("There can not be multiple selected values in a radio renderer!")
 
   ## Check if the selection value is among the filtered options. If not the 
-filterd_values = [str(o[1]) for o in options if o[2]]
+filterd_values = set(str(o[1]) for o in options if o[2])
 if str(selected) in filterd_values:
   selected = str(selected)
 else:
@@ -1,12 +1,15 @@
 <%
 value = field.get_value() or []
-selected = [str(id) for id in value if id]
+selected = set(str(id) for id in value if id)
 %>
 % if field.is_readonly():
   <div class="readonlyfield" name="${field.name}">
     ${field.get_value(expand=True) or "&nbsp;"}
   </div>
 % else:
+  % if field.renderer.search == "true":
+    <input type="text" class="form-control formbar-option-search" formbar-search="${field.id}" placeholder="${_('Search')}" autocomplete="off"/>
+  % endif
   <select class="form-control" id="${field.id}" name="${field.name}" size="5" multiple>
     % for option in options:
       ## Depending if the options has passed the configured filter the
@@ -22,4 +25,7 @@ selected = [str(id) for id in value if id]
       % endif
     % endfor
   </select>
+  % if field.renderer.search == "true":
+    <a href="#" class="formbar-option-more hidden" formbar-search="${field.id}">${_('More')}</a>
+  % endif
 % endif
@@ -1,6 +1,6 @@
 <%
 value = field.get_value() or []
-selected = [str(id) for id in value if id]
+selected = set(str(id) for id in value if id)
 inputvalue = []
 for option in options:
   if str(option[1]) in selected:
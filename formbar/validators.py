@@ -1,5 +1,46 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import importlib
+
+_registry = {}
+"""Dictionary with registered validators. The key is the name of the
+validator."""
+
+_resolved = {}
+"""Dictionary with validators which has been resolved by their module
+path."""
+
+
+def register_validator(name, callback):
+    """Registers the given callable as validator with the given name.
+    Registered validators can be referenced by their name in the src
+    attribute of validators in the form configuration.
+
+    :name: Name of the validator
+    :callback: Python callable which actually will do the check.
+    """
+    _registry[name] = callback
+
+
+def get_validator(src):
+    """Returns the callable of the validator for the given src. The
+    src is either the name of a registered validator or the module path
+    to the callable (e.g "formbar.validators.null_validator"). Module
+    paths are imported only once.
+
+    :src: Name or module path of the validator
+    :returns: Python callable
+    """
+    if src in _registry:
+        return _registry[src]
+    callback = _resolved.get(src)
+    if callback is None:
+        if "." not in src:
+            raise KeyError('Validator "%s" is not registered' % src)
+        module, name = src.rsplit(".", 1)
+        callback = getattr(importlib.import_module(module), name)
+        _resolved[src] = callback
+    return callback
 
 
 def null_validator(field, data):
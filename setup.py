@@ -21,8 +21,8 @@ setup(name='formbar',
     packages=find_packages(),
     include_package_data=True,
     zip_safe=False,
-    install_requires=['brabbel>=0.2.6',
-                      'sqlalchemy',
+    install_requires=['brabbel>=0.2.6,<0.4',
+                      'sqlalchemy>=1.2',
                       'babel',
                       'python-dateutil',
                       'mako',
@@ -1,19 +1,43 @@
 import os
+import time
+import threading
+import hashlib
+import decimal
 import datetime
 import unittest
+from io import BytesIO
 
-from sqlalchemy import create_engine, Column, Integer, String
+from sqlalchemy import (
+    create_engine, event, inspect, Column, Integer, String, ForeignKey
+)
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.orm import scoped_session, sessionmaker, relationship
 
 engine = create_engine('sqlite:///:memory:', echo=False)
 Session = scoped_session(sessionmaker())
 Session.configure(bind=engine)
 Base = declarative_base()
 
+import formbar.form
 from formbar import test_dir
-from formbar.config import load, Config
-from formbar.form import Form, StateError, Validator
+from formbar.config import load, parse, Config
+from formbar.converters import (
+    to_manytomany, to_manytoone, check_items, RelatedId, RelatedIds,
+    DeserializeException, register_converter, get_deserializer,
+    to_integer_column, to_float_column, to_date_column, to_datetime_column,
+    to_timedelta_column, to_uploaded_file, UploadedFile
+)
+from formbar.form import (
+    Form, FormPrototype, StateError, SearchError, Validator, loader_options,
+    is_changed,
+    get_thread_pool, set_validator_threads, VALIDATOR_THREADS
+)
+from formbar.parallel import ValidationPool
+from formbar.cache import OptionCache
+from formbar.rules import Rule, FilterTemplate
+from formbar.validators import register_validator, get_validator
+from formbar.helpers import get_timezone, UTC
+from formbar.renderer import FormRenderer, get_render_plan
 
 RESULT="""<html><body><div class="formbar-form"><form id="customform" class="testcss" method="GET" action="http://" autocomplete="off"> <div class="row-fluid"> <div class="span12"> <label for="string"> String field</label> <div class="readonlyfield"> &nbsp; </div> </div> </div> <div class="row-fluid"> <div class="span6"> <label for="default"> Default</label> <div class="readonlyfield"> &nbsp; </div> </div> <div class="span6"> <label for="select"> Select</label> <div class="readonlyfield"> &nbsp; </div> </div> </div> <div class="row-fluid"> <div class="span6"> <label for="float"> Float field</label> <div class="readonlyfield"> &nbsp; </div> <div class="text-help"> <i class="icon-info-sign"></i> This is is a very long helptext which should span over multiple rows. Further the will check if there are further html tags allowed.</div> </div> <div class="span6"> <label for="date"> <sup>(1)</sup> Date field</label> <div class="readonlyfield"> &nbsp; </div> <div class="text-help"> <i class="icon-info-sign"></i> This is my helptext</div> </div> </div> <div class="row-fluid"> <div class="span6"> <label for="string"> String field</label> <div class="readonlyfield"> &nbsp; </div> </div> <div class="span6"> <label for="integer"> Integer field <a href="#" data-toggle="tooltip" class="formbar-tooltip" data-original-title="Required fa_field"><i class="icon-asterisk"></i></a></label> <div class="readonlyfield"> &nbsp; </div> </div> </div>
 </form></div></body></html>"""
@@ -22,6 +46,16 @@ def external_validator(field, data):
     return 16 == data[field]
 
 
+def slow_validator(field, data):
+    time.sleep(0.2)
+    return False
+
+
+def very_slow_validator(field, data):
+    time.sleep(1)
+    return False
+
+
 class User(Base):
     __tablename__ = 'users'
 
@@ -39,6 +73,21 @@ class User(Base):
         return "<User('%s','%s', '%s')>" % (self.name, self.fullname,
                                             self.password)
 
+class Task(Base):
+    __tablename__ = 'tasks'
+
+    id = Column(Integer, primary_key=True)
+    title = Column(String)
+    level = Column(Integer)
+    user_id = Column(Integer, ForeignKey('users.id'))
+    user = relationship(User, foreign_keys=[user_id])
+    owner_id = Column(Integer, ForeignKey('users.id'))
+    owner = relationship(User, foreign_keys=[owner_id])
+
+    def get_values(self):
+        return {"title": self.title, "level": self.level}
+
+
 class TestInheritedForm(unittest.TestCase):
 
     def setUp(self):
@@ -101,10 +150,121 @@ class TestFormValidation(unittest.TestCase):
         self.form.add_validator(validator)
         self.assertEqual(self.form.validate(values), False)
 
+    def test_form_validate_concurrent(self):
+        values = {'default': 'test', 'integer': '16', 'date': '1998-02-01'}
+        self.form.add_validator(Validator('integer', 'First', slow_validator,
+                                          concurrent=True))
+        self.form.add_validator(Validator('integer', 'Second',
+                                          slow_validator, concurrent=True))
+        self.form.add_validator(Validator('integer', 'Third',
+                                          lambda field, data: False))
+        start = time.time()
+        result = self.form.validate_data(values)
+        self.assertTrue(time.time() - start < 0.4)
+        self.assertEqual(result.errors['integer'],
+                         ['First', 'Second', 'Third'])
+
+    def test_form_validate_concurrent_timeout(self):
+        values = {'default': 'test', 'integer': '16', 'date': '1998-02-01'}
+        self.form.add_validator(Validator('integer', 'Timeout',
+                                          slow_validator, concurrent=True,
+                                          timeout=0.01))
+        self.assertEqual(self.form.validate(values), False)
+        self.assertEqual(self.form.get_errors()['integer'],
+                         set(['Validation timed out']))
+
+    def test_form_validate_concurrent_deadline(self):
+        values = {'default': 'test', 'integer': '16', 'date': '1998-02-01'}
+        self.form.add_validator(Validator('integer', 'Timeout',
+                                          very_slow_validator,
+                                          concurrent=True, timeout=0.3))
+        self.form.add_validator(Validator('integer', 'Slow',
+                                          slow_validator))
+        start = time.time()
+        result = self.form.validate_data(values)
+        # The timeout starts with the concurrent validator and not after
+        # the slow synchronous validator.
+        self.assertTrue(time.time() - start < 0.45)
+        self.assertEqual(result.errors['integer'],
+                         ['Validation timed out', 'Slow'])
+
+    def test_form_validate_concurrent_exhausted(self):
+        values = {'default': 'test', 'integer': '16', 'date': '1998-02-01'}
+        set_validator_threads(1)
+        try:
+            form = Form(self.form._config)
+            form.add_validator(Validator('integer', 'Timeout',
+                                         slow_validator, concurrent=True,
+                                         timeout=0.01))
+            form.validate_data(values)
+            self.assertEqual(get_thread_pool().in_flight, 1)
+            # Without a free thread the validators are checked in the
+            # current thread, also if they have a timeout.
+            form = Form(self.form._config)
+            form.add_validator(Validator('integer', 'No thread',
+                                         external_validator, concurrent=True,
+                                         timeout=0.01))
+            form.add_validator(Validator('integer', 'Synchronous',
+                                         lambda field, data: False,
+                                         concurrent=True))
+            result = form.validate_data(values)
+            self.assertEqual(get_thread_pool().in_flight, 1)
+            self.assertEqual(result.errors['integer'], ['Synchronous'])
+        finally:
+            set_validator_threads(VALIDATOR_THREADS)
+
+    def test_form_validate_concurrent_config(self):
+        register_validator('slow_validator', slow_validator)
+        xml = ('<configuration><source>'
+               '<entity id="e0" name="integer" type="integer">'
+               '<validator src="slow_validator" msg="Timeout" '
+               'concurrent="true" timeout="0.01"/></entity>'
+               '</source><form id="concurrentform"><field ref="e0"/>'
+               '</form></configuration>')
+        form = Form(Config(parse(xml)).get_form('concurrentform'))
+        validator = form.get_field('integer').get_validators()[0]
+        self.assertEqual((validator._concurrent, validator._timeout),
+                         (True, 0.01))
+        start = time.time()
+        result = form.validate_data({'integer': '16'})
+        self.assertTrue(time.time() - start < 0.15)
+        self.assertEqual(result.errors['integer'], ['Validation timed out'])
+
     def test_form_validate_ext_validator_ok(self):
         values = {'default': 'test', 'integer': '16', 'date': '1998-02-01'}
         self.assertEqual(self.form.validate(values), True)
 
+    def test_form_validate_data_ok(self):
+        values = {'default': 'test', 'integer': '16', 'date': '1998-02-01'}
+        result = self.form.validate_data(values)
+        self.assertEqual(result.valid, True)
+        self.assertEqual(result.data['integer'], 16)
+        self.assertEqual(result.data['date'], datetime.date(1998, 2, 1))
+        self.assertEqual(self.form.validated, False)
+
+    def test_form_validate_data_fail(self):
+        values = {'select': '2', 'integer': '15', 'date': 'foo'}
+        result = self.form.validate_data(values)
+        self.assertEqual(result.valid, False)
+        self.assertEqual(sorted(result.errors.keys()), ['date', 'integer'])
+        self.assertEqual(sorted(result.warnings.keys()), ['float', 'select'])
+        self.assertEqual(self.form.has_errors(), False)
+
+    def test_form_validate_many(self):
+        records = [{'default': 'test', 'integer': '16', 'date': '1998-02-01'},
+                   {'default': 'test', 'integer': '15', 'date': '1998-02-01'},
+                   {'default': 'test', 'integer': '17', 'date': '1998-02-01'}]
+        results = list(self.form.validate_many(iter(records)))
+        self.assertEqual([r.valid for r in results], [True, False, True])
+        self.assertEqual(results[2].data['integer'], 17)
+
+    def test_form_validate_many_chunks(self):
+        records = [{'integer': str(i), 'date': '1998-02-01'}
+                   for i in range(10, 20)]
+        chunks = list(self.form.validate_many(records, chunksize=4))
+        self.assertEqual([len(c) for c in chunks], [4, 4, 2])
+        self.assertEqual(chunks[2][1].data['integer'], 19)
+
     def test_form_deserialize_int(self):
         values = {'default': 'test', 'integer': '16', 'date': '1998-02-01'}
         self.form.validate(values)
@@ -168,6 +328,13 @@ class TestFormValidation(unittest.TestCase):
     def test_form_fields(self):
         self.assertEqual(len(self.form.fields.values()), 9)
 
+    def test_form_fields_lazy(self):
+        self.assertEqual(len(self.form.fields.loaded()), 0)
+        values = {'default': 'test', 'integer': '16', 'date': '1998-02-01'}
+        self.form.validate(values)
+        for field in self.form.fields.loaded():
+            self.assertEqual(field._renderer, None)
+
     def test_form_field_select_options(self):
         selfield = self.form.get_field('select')
         self.assertEqual(len(selfield.get_options()), 4)
@@ -198,6 +365,564 @@ class TestFormValidation(unittest.TestCase):
         self.assertEqual(num_rules, 3)
 
 
+class PageItem(object):
+
+    def __init__(self):
+        self.accessed = []
+
+    def __getattr__(self, name):
+        self.accessed.append(name)
+        return {'integer': 16, 'float': 99.0, 'select': 1}[name]
+
+
+class TestPageValidation(unittest.TestCase):
+
+    def setUp(self):
+        tree = load(os.path.join(test_dir, 'form.xml'))
+        config = Config(tree)
+        form_config = config.get_form('pageform')
+        self.form = Form(form_config)
+
+    def test_page_scope(self):
+        fields, needed = self.form._prototype.get_page_scope(2)
+        self.assertEqual(fields, set(['float', 'select']))
+        self.assertEqual(needed, set(['float', 'select', 'integer']))
+
+    def test_validate_page(self):
+        values = {'integer': '15', 'float': 'abc'}
+        self.assertEqual(self.form.validate(values, page=1), False)
+        self.assertEqual(self.form.get_errors().keys(), ['integer'])
+        self.assertEqual(self.form.has_warnings(), False)
+
+    def test_validate_page_dependencies(self):
+        values = {'integer': '15', 'float': '200', 'select': '2'}
+        self.assertEqual(self.form.validate(values, page=2), True)
+        self.assertEqual(self.form.get_warnings().keys(), ['select'])
+        self.assertEqual(self.form.data, {'float': 200.0, 'select': 2})
+
+    def test_validate_page_invalid_dependency(self):
+        xml = ('<configuration><source>'
+               '<entity id="e0" name="a" type="integer">'
+               '<rule expr="$b ne 1" msg="B is 1"/></entity>'
+               '<entity id="e1" name="b" type="integer"/>'
+               '</source><form id="dependencyform">'
+               '<page id="p1" label="Page 1"><field ref="e0"/></page>'
+               '<page id="p2" label="Page 2"><field ref="e1"/></page>'
+               '</form></configuration>')
+        form = Form(Config(parse(xml)).get_form('dependencyform'))
+        result = form.validate_data({'a': '1', 'b': '1'}, page=1)
+        self.assertEqual(result.errors, {'a': ['B is 1']})
+        self.assertEqual(form.validate({'a': '1', 'b': 'abc'}, page=1), True)
+        self.assertEqual(form.get_errors(), {})
+        self.assertEqual(form.data, {'a': 1})
+
+    def test_validate_page_conditional(self):
+        values = {'integer': '16', 'float': '200'}
+        result = self.form.validate_data(values, page=2)
+        self.assertEqual(result.errors.keys(), ['float'])
+
+    def test_validate_unknown_page(self):
+        self.assertRaises(KeyError, self.form.validate, {}, page=3)
+
+    def test_load_scope(self):
+        self.assertEqual(self.form._prototype.get_load_scope(1),
+                         set(['integer']))
+
+    def test_scoped_form(self):
+        item = PageItem()
+        form = self.form._prototype.create(item, page=1)
+        self.assertEqual(form.loaded_data, {'integer': 16})
+        self.assertEqual(item.accessed, ['integer'])
+
+    def test_scoped_render(self):
+        form = self.form._prototype.create(page=1)
+        html = form.render()
+        self.assertTrue('name="integer"' in html)
+        self.assertTrue('name="float"' not in html)
+        self.assertEqual(form.validate({'integer': '15', 'float': 'abc'}),
+                         False)
+        self.assertEqual(form.get_errors().keys(), ['integer'])
+
+    def test_scoped_render_page_id(self):
+        xml = ('<configuration><source>'
+               '<entity id="e0" name="a" type="integer"/>'
+               '<entity id="e1" name="b" type="integer"/>'
+               '</source><form id="gapform">'
+               '<page id="p1" label="Page 1"><field ref="e0"/></page>'
+               '<page id="p5" label="Page 5"><field ref="e1"/></page>'
+               '</form></configuration>')
+        prototype = FormPrototype(Config(parse(xml)).get_form('gapform'))
+        html = prototype.create(page=5).render()
+        self.assertTrue('class="formbar-page active" id="formbar-page-2"'
+                        in html)
+        self.assertTrue('href="#p5" class="list-group-item selected"' in html)
+        self.assertTrue('href="#p1" class="list-group-item selected"'
+                        not in html)
+
+
+class TestOptionSearch(unittest.TestCase):
+
+    def setUp(self):
+        tree = load(os.path.join(test_dir, 'form.xml'))
+        self.config = Config(tree)
+        self.form = Form(self.config.get_form('customform'))
+        self.field = self.form.get_field('select')
+
+    def test_search(self):
+        result = self.field.search_options(u"value")
+        self.assertEqual(sorted(o["id"] for o in result["options"]),
+                         ["1", "2", "3", "4"])
+        self.assertEqual(result["more"], False)
+
+    def test_search_term(self):
+        result = self.field.search_options(u"Value 4")
+        self.assertEqual(result["options"], [{"id": "4", "label": "Value 4"}])
+
+    def test_search_paging(self):
+        form = Form(self.config.get_form('searchform'))
+        params = {"field": "search", "term": "", "page": "1"}
+        result = form.search_options(params, pagesize=3)
+        self.assertEqual(len(result["options"]), 1)
+        self.assertEqual(result["page"], 1)
+        result = form.search_options(params, pagesize=1)
+        self.assertEqual(result["more"], True)
+
+    def test_search_invalid(self):
+        form = Form(self.config.get_form('searchform'))
+        for params in ({"term": ""},
+                       {"field": "unknown"},
+                       {"field": "select"},
+                       {"field": "search", "page": "one"},
+                       {"field": "search", "page": "-1"},
+                       {"field": "search", "page": None}):
+            self.assertRaises(SearchError, form.search_options, params)
+
+    def test_selected_options(self):
+        self.field.value = "2"
+        options = self.field.get_options(selected=True)
+        self.assertEqual([option[1] for option in options], ["2"])
+
+
+class TestOptionLabels(unittest.TestCase):
+
+    def setUp(self):
+        tree = load(os.path.join(test_dir, 'form.xml'))
+        config = Config(tree)
+        self.form = Form(config.get_form('filterform'))
+        self.field = self.form.get_field('level')
+
+    def test_expand(self):
+        self.field.value = ["3", "1", "3"]
+        self.assertEqual(self.field.get_value(expand=True),
+                         "Level 1, Level 3")
+
+    def test_expand_previous(self):
+        self.field.value = "1"
+        self.field.previous_value = "3"
+        self.assertEqual(self.field.get_value(expand=True), "Level 1")
+        self.assertEqual(self.field.get_previous_value(expand=True),
+                         "Level 3")
+
+    def test_options_loaded_once(self):
+        calls = []
+        get_options = self.field.get_options
+
+        def counting_get_options(*args, **kwargs):
+            calls.append(args)
+            return get_options(*args, **kwargs)
+        self.field.get_options = counting_get_options
+        self.field.value = "1"
+        self.field.previous_value = "3"
+        self.field.renderer._get_template_values()
+        self.field.get_value(expand=True)
+        self.field.get_previous_value(expand=True)
+        self.assertEqual(len(calls), 1)
+
+
+class FilterItem(object):
+
+    def get_values(self):
+        return {'select': '1'}
+
+
+class TestFilterTemplate(unittest.TestCase):
+
+    def setUp(self):
+        tree = load(os.path.join(test_dir, 'form.xml'))
+        self.config = Config(tree).get_form('filterform')
+
+    def test_template(self):
+        template = FilterTemplate("( %id gt 2 ) and ( $foo in @bar )")
+        self.assertEqual(template.attributes, ['id'])
+        self.assertEqual(template.params, [('_p0', '$foo'), ('_p1', '@bar')])
+        params, references = template.bind(lambda x: [1, 2])
+        self.assertEqual(params, {'_p0': [1.0, 2.0], '_p1': [1.0, 2.0]})
+
+    def test_shared_template(self):
+        prototype = FormPrototype(self.config)
+        self.assertTrue(prototype.get_filter_template('level')
+                        is prototype.get_filter_template('level'))
+
+    def test_filter_options(self):
+        form = Form(self.config)
+        options = form.get_field('level').get_options()
+        self.assertEqual([o[2] for o in options], [False, False, True])
+
+    def test_filter_options_params(self):
+        form = Form(self.config, FilterItem())
+        options = form.get_field('level').get_options()
+        self.assertEqual([o[2] for o in options], [True, False, True])
+
+
+class TestOptionFilter(unittest.TestCase):
+
+    def setUp(self):
+        tree = load(os.path.join(test_dir, 'form.xml'))
+        config = Config(tree)
+        self.form = Form(config.get_form('filterform'))
+
+    def test_filter_clause(self):
+        field = self.form.get_field('user')
+        clause = field._build_filter_clause(User)
+        sql = str(clause.compile(compile_kwargs={"literal_binds": True}))
+        self.assertEqual(sql, "users.name = 'ed' OR users.id <= 5")
+
+    def test_filter_clause_unsupported(self):
+        field = self.form.get_field('owner')
+        self.assertEqual(field._build_filter_clause(User), None)
+
+    def test_option_label(self):
+        engine = create_engine('sqlite:///:memory:', echo=False)
+        Base.metadata.create_all(engine)
+        session = sessionmaker(bind=engine)()
+        session.add(User('ed', 'Ed Jones', 16))
+        session.commit()
+        self.form._dbsession = session
+        field = self.form.get_field('user')
+        options = field._snapshot_options(User, ('password',),
+                                          '%name (%fullname)')
+        self.assertEqual(options, [(u'ed (Ed Jones)', 1, {'password': 16})])
+        session.close()
+
+
+class TestOptionFilterPushdown(unittest.TestCase):
+    """Filters done in the database must give the same options as the
+    filters evaluated by the rule system."""
+
+    filters = [
+        ("%name eq 'ed'", True),
+        ("%name ne 'ed'", True),
+        ("%name eq '5'", False),
+        ("%name eq 'ed' or %name eq 'mary'", True),
+        ("%name ne 'ed' and %password ne 16", True),
+        ("%id gt 2 and %id le @level", True),
+        ("%id ge $level or %password eq 16", True),
+        ("%id in $ids", True),
+        ("%password in $ids", True),
+        ("%id lt 3 or %name eq 'ed' and %id gt 4", False),
+        ("not %id gt 5", False),
+        ("( %name eq 'ed' or %password eq 16 ) and not %id gt 5", False),
+    ]
+
+    def setUp(self):
+        engine = create_engine('sqlite:///:memory:', echo=False)
+        Base.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+        self.session.add_all([User('ed', 'Ed Jones', 20),
+                              User('paul', 'Paul Wright', 16),
+                              User('mary'),
+                              User(None, 'Nobody', 5),
+                              User('5', 'Five', 16),
+                              User('ed', 'Ed Smith', 1)])
+        self.session.add(Task(title=u"Task", level=3))
+        self.session.commit()
+
+    def tearDown(self):
+        self.session.close()
+
+    def _get_field(self, expression, remove_filtered):
+        xml = ('<configuration><source>'
+               '<entity id="e0" name="user" type="manytoone">'
+               '<renderer type="dropdown" filter="%s" remove_filtered="%s"/>'
+               '</entity></source><form id="userfilter"><field ref="e0"/>'
+               '</form></configuration>' % (expression, remove_filtered))
+        form = Form(Config(parse(xml)).get_form('userfilter'),
+                    self.session.query(Task).one(), self.session,
+                    values={"ids": [1, 3, 5]})
+        return form.get_field('user')
+
+    def _get_visible(self, field):
+        return [o[1] for o in field.get_options() if o[1] != "" and o[2]]
+
+    def test_pushdown(self):
+        for expression, pushdown in self.filters:
+            field = self._get_field(expression, "true")
+            clause = field._build_filter_clause(User)
+            self.assertEqual(clause is not None, pushdown, expression)
+            expected = self._get_visible(self._get_field(expression, "false"))
+            if clause is not None:
+                ids = [u.id for u in self.session.query(User).filter(clause)
+                       .order_by(User.id)]
+                self.assertEqual(ids, expected, expression)
+            self.assertEqual(self._get_visible(field), expected, expression)
+
+
+class TestFormPrototype(unittest.TestCase):
+
+    def setUp(self):
+        tree = load(os.path.join(test_dir, 'form.xml'))
+        config = Config(tree)
+        form_config = config.get_form('customform')
+        self.prototype = FormPrototype(form_config)
+
+    def test_create(self):
+        form = self.prototype.create()
+        self.assertTrue(isinstance(form, Form))
+        self.assertEqual(len(form.fields), 9)
+
+    def test_shared_rules(self):
+        form1 = self.prototype.create()
+        form2 = self.prototype.create()
+        self.assertTrue(form1.get_field('integer').get_rules()
+                        is form2.get_field('integer').get_rules())
+
+    def test_separate_state(self):
+        form1 = self.prototype.create()
+        form2 = self.prototype.create()
+        values = {'default': 'test', 'integer': '15', 'date': '1998-02-01'}
+        self.assertEqual(form1.validate(values), False)
+        self.assertEqual(form2.has_errors(), False)
+        values = {'default': 'test', 'integer': '16', 'date': '1998-02-01'}
+        self.assertEqual(form2.validate(values), True)
+
+    def test_external_validators(self):
+        validator = Validator('integer',
+                              'Error message',
+                              external_validator)
+        self.prototype.add_validator(validator)
+        form = self.prototype.create()
+        form.add_validator(validator)
+        self.assertEqual(len(form.external_validators), 2)
+        self.assertEqual(len(self.prototype.external_validators), 1)
+
+    def test_shared_validators(self):
+        validators = self.prototype.get_validators('integer')
+        self.assertEqual(len(validators), 1)
+        self.assertTrue(validators is self.prototype.get_validators('integer'))
+
+
+class TestValidatorRegistry(unittest.TestCase):
+
+    def test_module_path(self):
+        validator = get_validator('formbar.validators.null_validator')
+        self.assertTrue(validator(None, {}))
+
+    def test_registered(self):
+        register_validator('external', external_validator)
+        self.assertTrue(get_validator('external') is external_validator)
+
+    def test_unknown(self):
+        self.assertRaises(KeyError, get_validator, 'unknown')
+
+
+class TestConverterRegistry(unittest.TestCase):
+
+    def setUp(self):
+        register_converter('csv',
+                           lambda field, value: tuple(value.split(",")),
+                           lambda field, value: u",".join(value))
+        xml = ('<configuration><source>'
+               '<entity id="e0" name="tags" type="csv"/>'
+               '<entity id="e1" name="numbers" type="integer"/>'
+               '</source><form id="csvform"><field ref="e0"/>'
+               '<field ref="e1"/></form></configuration>')
+        self.form = Form(Config(parse(xml)).get_form('csvform'))
+
+    def test_deserialize(self):
+        result = self.form.validate_data({'tags': u'a,b',
+                                          'numbers': [u'1', u'2']})
+        self.assertEqual(result.data, {'tags': ('a', 'b'), 'numbers': [1, 2]})
+
+    def test_serialize(self):
+        self.assertEqual(self.form.serialize({'tags': ('a', 'b')}),
+                         {'tags': u'a,b'})
+
+    def test_unknown(self):
+        self.assertEqual(get_deserializer('unknown')(None, u'foo'), None)
+
+
+class TestDateConverters(unittest.TestCase):
+
+    def setUp(self):
+        xml = ('<configuration><source>'
+               '<entity id="e0" name="date" type="date"/>'
+               '<entity id="e1" name="datetime" type="datetime"/>'
+               '</source><form id="dateform"><field ref="e0"/>'
+               '<field ref="e1"/></form></configuration>')
+        self.config = Config(parse(xml)).get_form('dateform')
+
+    def test_locale(self):
+        form = Form(self.config, locale="de", timezone="UTC")
+        value = form.get_field('datetime').to_python(u"01.02.1998 12:30:00")
+        self.assertEqual(value, datetime.datetime(1998, 2, 1, 12, 30))
+        self.assertEqual(form.serialize({'date': value.date(),
+                                         'datetime': value}),
+                         {'date': u'01.02.1998',
+                          'datetime': u'01.02.1998 12:30:00'})
+
+    def test_timezone(self):
+        form = Form(self.config, timezone="Europe/Berlin")
+        field = form.get_field('datetime')
+        value = field.to_python(u"1998-07-01 12:30:00")
+        self.assertEqual(value, datetime.datetime(1998, 7, 1, 10, 30))
+        self.assertEqual(field.from_python(value), u"1998-07-01 12:30:00")
+
+    def test_timezone_cache(self):
+        self.assertTrue(get_timezone("Europe/Berlin")
+                        is get_timezone("Europe/Berlin"))
+        self.assertTrue(get_timezone("UTC") is UTC)
+        self.assertRaises(ValueError, get_timezone, "Unknown/Zone")
+
+
+class TestColumnConverters(unittest.TestCase):
+
+    def test_integer(self):
+        self.assertEqual(to_integer_column([u"1", u"2"]), ([1, 2], {}))
+
+    def test_integer_errors(self):
+        values, errors = to_integer_column([u"1", u"", u"x", u"9999999999"])
+        self.assertEqual(values, [1, None, None, None])
+        self.assertEqual(sorted(errors.keys()), [2, 3])
+        self.assertEqual(str(errors[2]), "x is not a integer value.")
+
+    def test_float(self):
+        self.assertEqual(to_float_column([u"1.5", u""]), ([1.5, None], {}))
+
+    def test_date(self):
+        values, errors = to_date_column([u"01.02.1998", u"1998-02-01",
+                                         u"01.02.1998"], "de")
+        self.assertEqual(values, [datetime.date(1998, 2, 1), None,
+                                  datetime.date(1998, 2, 1)])
+        self.assertEqual(errors.keys(), [1])
+
+    def test_datetime(self):
+        values, errors = to_datetime_column([u"1998-07-01 12:30:00"],
+                                            timezone="Europe/Berlin")
+        self.assertEqual(values, [datetime.datetime(1998, 7, 1, 10, 30)])
+
+    def test_timedelta(self):
+        values, errors = to_timedelta_column([u"01:12", u"1:2:3:4"])
+        self.assertEqual(values, [datetime.timedelta(hours=1, minutes=12),
+                                  None])
+        self.assertEqual(errors.keys(), [1])
+
+
+class Upload(object):
+    """Minimal replacement of a submitted cgi.FieldStorage."""
+
+    def __init__(self, content, filename="test.pdf"):
+        self.file = BytesIO(content)
+        self.filename = filename
+        self.type = "application/pdf"
+
+
+class TestUploadConverter(unittest.TestCase):
+
+    def setUp(self):
+        xml = ('<configuration><source>'
+               '<entity id="e0" name="upload" type="upload" maxsize="1000"/>'
+               '</source><form id="uploadform"><field ref="e0"/></form>'
+               '</configuration>')
+        self.config = Config(parse(xml)).get_form('uploadform')
+
+    def test_copy(self):
+        content = b"x" * 2500
+        uploaded = to_uploaded_file(Upload(content), chunk_size=1000)
+        self.assertTrue(isinstance(uploaded, UploadedFile))
+        self.assertEqual(uploaded.read(), content)
+        self.assertEqual(uploaded.size, 2500)
+        self.assertEqual(uploaded.sha256, hashlib.sha256(content).hexdigest())
+        self.assertEqual(uploaded.filename, "test.pdf")
+
+    def test_max_size(self):
+        upload = Upload(b"x" * 2500)
+        self.assertRaises(DeserializeException, to_uploaded_file, upload,
+                          1000, 500)
+        # Reading stops as soon as the maximum size is exceeded.
+        self.assertEqual(upload.file.tell(), 1500)
+
+    def test_no_file(self):
+        self.assertEqual(to_uploaded_file(u""), None)
+
+    def test_config_maxsize(self):
+        xml = ('<configuration><source>'
+               '<entity id="e0" name="upload" type="upload" maxsize="%s"/>'
+               '</source><form id="uploadform"><field ref="e0"/></form>'
+               '</configuration>')
+        config = Config(parse(xml % "0")).get_form('uploadform')
+        self.assertEqual(config.get_field('upload').maxsize, 0)
+        for maxsize in ("1MB", "-1"):
+            config = Config(parse(xml % maxsize))
+            with self.assertRaises(ValueError) as cm:
+                config.get_form('uploadform').get_field('upload')
+            self.assertTrue('entity "e0"' in str(cm.exception))
+
+    def test_validate(self):
+        form = Form(self.config)
+        self.assertFalse(form.validate({'upload': Upload(b"x" * 1001)}))
+        self.assertEqual(form.get_errors()['upload'],
+                         set(['File is larger than 1000 bytes.']))
+        form = Form(self.config)
+        self.assertTrue(form.validate({'upload': Upload(b"x" * 1000)}))
+        self.assertEqual(form.data['upload'].size, 1000)
+        self.assertEqual(form.serialize(form.data), {'upload': u'test.pdf'})
+
+
+class TestValidationPool(unittest.TestCase):
+
+    def setUp(self):
+        tree = load(os.path.join(test_dir, 'form.xml'))
+        config = Config(tree)
+        self.form_config = config.get_form('customform')
+
+    def test_validate_many(self):
+        records = [{'default': 'test', 'integer': str(i),
+                    'date': '1998-02-01'} for i in range(10, 30)]
+        with ValidationPool(self.form_config, processes=2,
+                            chunksize=3) as pool:
+            results = list(pool.validate_many(records))
+        self.assertEqual(len(results), 20)
+        self.assertEqual([r.data['integer'] for r in results], range(10, 30))
+        self.assertEqual([r.valid for r in results].count(True), 14)
+
+    def test_same_as_serial(self):
+        xml = ('<configuration><source>'
+               '<entity id="e0" name="datetime" type="datetime"/>'
+               '<entity id="e1" name="integer" type="integer"/>'
+               '</source><form id="poolform"><field ref="e0"/>'
+               '<field ref="e1"/></form></configuration>')
+        form_config = Config(parse(xml)).get_form('poolform')
+        records = [{'datetime': u'01.07.1998 12:30:00', 'integer': u'x'}]
+        form = Form(form_config, translate=translate, locale="de",
+                    timezone="Europe/Berlin")
+        expected = form.validate_data(records[0])
+        with ValidationPool(form_config, processes=1, locale="de",
+                            translate=translate,
+                            timezone="Europe/Berlin") as pool:
+            result = list(pool.validate_many(records))[0]
+        self.assertEqual(result.data, expected.data)
+        self.assertEqual(result.errors, expected.errors)
+        self.assertEqual(result.data['datetime'],
+                         datetime.datetime(1998, 7, 1, 10, 30))
+        self.assertEqual(result.errors['integer'],
+                         ['x ist keine Ganzzahl.'])
+
+
+def translate(msgid):
+    return {"%s is not a integer value.": "%s ist keine Ganzzahl."}.get(
+        msgid, msgid)
+
+
 class TestFormRenderer(unittest.TestCase):
 
     def setUp(self):
@@ -206,6 +931,19 @@ class TestFormRenderer(unittest.TestCase):
         form_config = config.get_form('customform')
         self.form = Form(form_config)
 
+    def test_renderer_attribute_error(self):
+        def get_renderer(field, translate):
+            raise AttributeError('broken renderer')
+        orig = formbar.form.get_renderer
+        formbar.form.get_renderer = get_renderer
+        try:
+            field = self.form.get_field('default')
+            with self.assertRaises(AttributeError) as cm:
+                field.renderer
+            self.assertEqual(str(cm.exception), 'broken renderer')
+        finally:
+            formbar.form.get_renderer = orig
+
     # Disable this test. Find better way to check if the rendering is
     # ok.
     #def test_form_render(self):
@@ -215,6 +953,61 @@ class TestFormRenderer(unittest.TestCase):
     #    self.assertEqual(html, check)
 
 
+class TemplateFormRenderer(FormRenderer):
+
+    def __init__(self, form, translate):
+        FormRenderer.__init__(self, form, translate, compiled=False)
+
+
+def normalize(html):
+    return [line.strip() for line in html.splitlines() if line.strip()]
+
+
+class TestRenderPlan(unittest.TestCase):
+
+    def setUp(self):
+        tree = load(os.path.join(test_dir, 'form.xml'))
+        self.config = Config(tree)
+
+    def render(self, form_id, compiled, **kwargs):
+        form = Form(self.config.get_form(form_id))
+        if compiled:
+            return normalize(form.render(**kwargs))
+        formbar.form.FormRenderer = TemplateFormRenderer
+        try:
+            return normalize(form.render(**kwargs))
+        finally:
+            formbar.form.FormRenderer = FormRenderer
+
+    def assertSameRendering(self, form_id, **kwargs):
+        self.assertEqual(self.render(form_id, True, **kwargs),
+                         self.render(form_id, False, **kwargs))
+
+    def test_layout(self):
+        self.assertSameRendering('layoutform', values={'integer': 16})
+        self.assertSameRendering('layoutform', values={'integer': 3})
+
+    def test_snippets(self):
+        self.assertSameRendering('customform')
+
+    def test_pages(self):
+        values = {'integer': 16}
+        self.assertSameRendering('pageform', page=2, values=values)
+        self.assertSameRendering('pageform', outline=False, values=values)
+
+    def test_static_conditionals(self):
+        html = self.render('layoutform', True, values={'integer': 3})
+        self.assertTrue('<div class="readonlyfield" name="integer">'
+                        in "".join(html))
+        self.assertFalse('name="string"' in "".join(html))
+
+    def test_cached(self):
+        form_config = self.config.get_form('layoutform')
+        plan = get_render_plan(form_config)
+        self.assertTrue(get_render_plan(form_config) is plan)
+        self.assertFalse(get_render_plan(form_config, False) is plan)
+
+
 class TestFormAlchemyForm(unittest.TestCase):
 
     def _insert_item(self):
@@ -244,6 +1037,23 @@ class TestFormAlchemyForm(unittest.TestCase):
         form = Form(form_config, item)
         self.assertEqual(len(form.fields), 3)
 
+    def test_default_expression(self):
+        form_config = self.config.get_form('userform3')
+        item = User('ed', 'Ed Jones', 'edspassword')
+        form = Form(form_config, item)
+        self.assertEqual(form._loaded_data, None)
+        self.assertEqual(form.get_field('nickname').get_value(), 'ed')
+        self.assertEqual(form.loaded_data['name'], 'ed')
+
+    def test_validate_without_loading(self):
+        form_config = self.config.get_form('userform2')
+        item = User('ed', 'Ed Jones', 'edspassword')
+        form = Form(form_config, item)
+        values = {"name": "paulpaulpaul", "fullname": "Paul Wright",
+                  "password": "1"}
+        self.assertEqual(form.validate(values), True)
+        self.assertEqual(form._loaded_data, None)
+
     def test_create_save(self):
         form_config = self.config.get_form('userform2')
         item = User()
@@ -275,6 +1085,259 @@ class TestFormAlchemyForm(unittest.TestCase):
         self.assertEqual(result[0].name, "ed")
         self.assertEqual(result[1].name, "paulpaulpaul")
 
+    def test_changed_fields(self):
+        form_config = self.config.get_form('userform2')
+        item = User('ed', 'Ed Jones', 'edspassword')
+        self.session.add(item)
+        self.session.flush()
+        form = Form(form_config, item)
+        values = {"name": "ed", "fullname": "Paul Wright", "password": "1"}
+        self.assertEqual(form.changed_fields, {})
+        self.assertEqual(form.validate(values), True)
+        self.assertEqual(sorted(form.changed_fields.keys()),
+                         ["fullname", "password"])
+        self.assertEqual(form.changed_fields["fullname"],
+                         ("Ed Jones", "Paul Wright"))
+        form.save()
+        self.assertEqual(inspect(item).attrs.name.history.has_changes(),
+                         False)
+        self.assertEqual(inspect(item).attrs.fullname.history.has_changes(),
+                         True)
+
+
+class TestIsChanged(unittest.TestCase):
+
+    def test_values(self):
+        self.assertEqual(is_changed(u"foo", "foo"), False)
+        self.assertEqual(is_changed(1, 1.0), False)
+        self.assertEqual(is_changed(None, u""), True)
+        self.assertEqual(is_changed(u"1", 1), True)
+        self.assertEqual(is_changed(datetime.date(1998, 2, 1),
+                                    datetime.date(1998, 2, 1)), False)
+        self.assertEqual(is_changed(decimal.Decimal('1.10'), 1.1), False)
+        self.assertEqual(is_changed(decimal.Decimal('1.10'), 1.2), True)
+        self.assertEqual(is_changed(decimal.Decimal('0.30'), 0.1 + 0.2),
+                         True)
+
+    def test_relations(self):
+        users = [User('ed'), User('paul')]
+        users[0].id, users[1].id = 1, 2
+        self.assertEqual(is_changed(users, RelatedIds(User, [2, 1], None)),
+                         False)
+        self.assertEqual(is_changed(users, RelatedIds(User, [1], None)),
+                         True)
+        self.assertEqual(is_changed(users[0], RelatedId(User, 1, None)),
+                         False)
+        self.assertEqual(is_changed(None, RelatedId(User, 1, None)), True)
+        self.assertEqual(is_changed([], []), False)
+
+
+class TestLoaderOptions(unittest.TestCase):
+
+    def setUp(self):
+        tree = load(os.path.join(test_dir, 'form.xml'))
+        self.config = Config(tree).get_form('filterform')
+        self.engine = create_engine('sqlite:///:memory:', echo=False)
+        Base.metadata.create_all(self.engine)
+        self.session = sessionmaker(bind=self.engine)()
+        user = User('ed')
+        self.session.add(Task(title=u"Task", level=1, user=user, owner=user))
+        self.session.commit()
+        self.session.expunge_all()
+        self.queries = []
+        self.threads = set()
+        event.listen(self.engine, "before_cursor_execute", self._count)
+
+    def tearDown(self):
+        event.remove(self.engine, "before_cursor_execute", self._count)
+        self.session.close()
+
+    def _count(self, *args):
+        self.queries.append(args)
+        self.threads.add(threading.current_thread())
+
+    def test_loader_options(self):
+        options = loader_options(self.config, Task)
+        item = self.session.query(Task).options(*options).one()
+        self.assertEqual(len(self.queries), 1)
+        self.assertTrue("title" not in item.__dict__)
+        form = Form(self.config, item, self.session)
+        self.assertEqual(form._get_data_from_item()["user"].name, "ed")
+        self.assertEqual(len(self.queries), 1)
+
+    def test_validator_related_attributes(self):
+        item = self.session.query(Task).one()
+        form = Form(self.config, item, self.session)
+        form.add_validator(Validator(
+            'user', 'Not ed', lambda field, data: data[field].name == 'ed'))
+        values = {"user": str(item.user_id), "owner": str(item.owner_id),
+                  "level": "1"}
+        self.assertEqual(form.validate(values), True)
+        self.assertEqual(form.data["user"].id, item.user_id)
+
+    def test_concurrent_validator_related_attributes(self):
+        item = self.session.query(Task).one()
+        form = Form(self.config, item, self.session)
+        form.add_validator(Validator(
+            'user', 'Not ed', lambda field, data: data[field].name == 'ed',
+            concurrent=True))
+        values = {"user": str(item.user_id), "owner": str(item.owner_id),
+                  "level": "1"}
+        self.assertEqual(form.validate(values), True)
+        # The related items are loaded before the concurrent validator
+        # is started.
+        self.assertEqual(self.threads, set([threading.current_thread()]))
+
+    def test_loader_options_item_attributes(self):
+        xml = ('<configuration><source>'
+               '<entity id="e0" name="user" type="manytoone">'
+               '<renderer type="dropdown" filter="%id ne @owner_id"/>'
+               '</entity><entity id="e1" name="label" value="$title"/>'
+               '</source><form id="taskform"><field ref="e0"/>'
+               '<field ref="e1"/></form></configuration>')
+        config = Config(parse(xml)).get_form('taskform')
+        options = loader_options(config, Task)
+        self.assertTrue(loader_options(config, Task) is options)
+        item = self.session.query(Task).options(*options).one()
+        self.assertTrue("title" in item.__dict__)
+        self.assertTrue("owner_id" in item.__dict__)
+        self.assertTrue("level" not in item.__dict__)
+
+    def test_shared_loader_options(self):
+        prototype = FormPrototype(self.config)
+        self.assertTrue(prototype.loader_options(Task)
+                        is prototype.loader_options(Task))
+
+
+class TestRelationConverters(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine('sqlite:///:memory:', echo=False)
+        Base.metadata.create_all(self.engine)
+        self.session = sessionmaker(bind=self.engine)()
+        self.session.add_all([User('ed'), User('paul'), User('mary')])
+        self.session.commit()
+        self.ids = [u.id for u in self.session.query(User)]
+        self.session.expunge_all()
+        self.queries = []
+        event.listen(self.engine, "before_cursor_execute", self._count)
+
+    def tearDown(self):
+        event.remove(self.engine, "before_cursor_execute", self._count)
+        self.session.close()
+
+    def _count(self, *args):
+        self.queries.append(args)
+
+    def test_manytomany(self):
+        items = to_manytomany(User, self.ids, self.session, [])
+        self.assertEqual(sorted(i.id for i in items), sorted(self.ids))
+        self.assertEqual(len(self.queries), 1)
+
+    def test_manytomany_missing(self):
+        self.assertRaises(DeserializeException, to_manytomany,
+                          User, self.ids + [999], self.session, [])
+
+    def test_manytoone_identity_map(self):
+        item = self.session.query(User).get(self.ids[0])
+        self.queries = []
+        self.assertTrue(to_manytoone(User, item.id, self.session, None)
+                        is item)
+        self.assertEqual(len(self.queries), 0)
+
+    def test_manytoone_missing(self):
+        self.assertRaises(DeserializeException, to_manytoone,
+                          User, 999, self.session, None)
+
+    def test_check_items(self):
+        check_items(User, self.ids, self.session)
+        self.assertEqual(len(self.queries), 1)
+        self.assertEqual(len(self.session.identity_map), 0)
+        self.assertRaises(DeserializeException, check_items,
+                          User, [999], self.session)
+
+    def test_related_ids(self):
+        references = RelatedIds(User, self.ids, self.session)
+        self.assertEqual(references, self.ids)
+        self.assertEqual(len(self.queries), 0)
+        items = references.load()
+        self.assertEqual(sorted(i.id for i in items), sorted(self.ids))
+        self.assertEqual(len(self.queries), 1)
+
+    def test_related_id(self):
+        reference = RelatedId(User, self.ids[0], self.session)
+        self.assertEqual(reference, self.ids[0])
+        self.assertEqual(reference.load().id, self.ids[0])
+
+    def test_related_id_attributes(self):
+        reference = RelatedId(User, self.ids[0], self.session)
+        self.assertEqual(reference.id, self.ids[0])
+        self.assertEqual(len(self.queries), 0)
+        self.assertEqual(reference.name, reference.load().name)
+        self.assertEqual(reference.name, "ed")
+        self.assertEqual(len(self.queries), 1)
+        self.assertRaises(AttributeError, getattr, reference, "missing")
+
+    def test_related_ids_items(self):
+        references = RelatedIds(User, self.ids, self.session)
+        self.assertEqual(sorted(i.name for i in references.items),
+                         ["ed", "mary", "paul"])
+        self.assertTrue(references.items is references.load())
+        self.assertEqual(len(self.queries), 1)
+
+    def test_related_id_rule(self):
+        reference = RelatedId(User, self.ids[0], self.session)
+        rule = Rule("$user eq %s" % self.ids[0])
+        self.assertEqual(rule.evaluate({"user": reference}), True)
+        self.assertEqual(len(self.queries), 0)
+
+
+class TestOptionCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = OptionCache(maxsize=2)
+
+    def test_get(self):
+        self.assertEqual(self.cache.get((User, ()), lambda: [1]), [1])
+        self.assertEqual(self.cache.get((User, ()), lambda: [2]), [1])
+        self.assertEqual(self.cache.stats()["hits"], 1)
+        self.assertEqual(self.cache.hit_rate, 0.5)
+
+    def test_lru(self):
+        self.cache.get((User, ("a",)), lambda: [1])
+        self.cache.get((User, ("b",)), lambda: [2])
+        self.cache.get((User, ("a",)), lambda: [3])
+        self.cache.get((User, ("c",)), lambda: [4])
+        self.assertEqual(len(self.cache), 2)
+        self.assertEqual(self.cache.evictions, 1)
+        self.assertEqual(self.cache.get((User, ("a",)), lambda: [5]), [1])
+        self.assertEqual(self.cache.get((User, ("b",)), lambda: [6]), [6])
+
+    def test_ttl(self):
+        cache = OptionCache(ttl=0)
+        cache.get((User, ()), lambda: [1])
+        self.assertEqual(cache.get((User, ()), lambda: [2]), [2])
+
+    def test_invalidate_while_loading(self):
+        def loader():
+            self.cache.invalidate(User)
+            return [1]
+        self.assertEqual(self.cache.get((User, ()), loader), [1])
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.get((User, ()), lambda: [2]), [2])
+        self.assertEqual(self.cache.get((User, ()), lambda: [3]), [2])
+
+    def test_invalidate_on_commit(self):
+        engine = create_engine('sqlite:///:memory:', echo=False)
+        Base.metadata.create_all(engine)
+        session = sessionmaker(bind=engine)()
+        self.cache.listen(session)
+        self.cache.get((User, ()), lambda: [1])
+        session.add(User('ed'))
+        session.commit()
+        self.assertEqual(len(self.cache), 0)
+        session.close()
+
 
 if __name__ == '__main__':
     unittest.main()